@@ -0,0 +1,120 @@
+"""
+Import time benchmark for the mlchr package.
+Every module is imported in a fresh interpreter. The benchmark fails
+(exit status 1) if a module loads a heavy dependency it should not, takes
+longer than its budget, or regresses against a baseline JSON report.
+
+Usage: python benchmarks/import_time.py [--baseline old.json] [--output new.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# module: (budget in seconds, dependencies it must not load)
+MODULES = {
+    'mlchr': (0.5, ('tensorflow', 'sklearn', 'scipy', 'PIL')),
+    'mlchr.utils.utils': (1.0, ('tensorflow', 'sklearn', 'scipy')),
+    'mlchr.utils.dataset': (1.0, ('tensorflow', 'sklearn', 'scipy')),
+    'mlchr.utils.metrics': (0.5, ('tensorflow', 'sklearn', 'scipy', 'PIL')),
+    'mlchr.utils.evaluation': (1.0, ('tensorflow', 'sklearn', 'scipy')),
+    'mlchr.utils.profiling': (0.5, ('tensorflow', 'sklearn', 'scipy',
+                                    'PIL')),
+    'mlchr.normalization.normalize': (1.0, ('tensorflow', 'sklearn',
+                                            'scipy')),
+    'mlchr.feature_extraction.zones': (1.0, ('tensorflow', 'sklearn',
+                                             'scipy')),
+    'mlchr.feature_extraction.projections': (1.0, ('tensorflow', 'sklearn',
+                                                   'scipy')),
+    'mlchr.feature_extraction.subdivisions': (1.0, ('tensorflow', 'sklearn',
+                                                    'scipy')),
+    'mlchr.feature_extraction.union': (1.0, ('tensorflow', 'sklearn',
+                                             'scipy')),
+    'mlchr.feature_extraction.cache': (1.0, ('tensorflow', 'sklearn',
+                                             'scipy')),
+    'mlchr.classifiers.template_matching': (1.0, ('tensorflow', 'sklearn',
+                                                  'scipy')),
+    'mlchr.classifiers.condensation': (1.0, ('tensorflow', 'sklearn',
+                                              'scipy')),
+    'mlchr.classifiers.knn': (1.0, ('tensorflow', 'sklearn', 'scipy')),
+    'mlchr.classifiers.numpy_ann': (1.0, ('tensorflow', 'sklearn', 'scipy')),
+    'mlchr.classifiers.ann': (1.0, ('tensorflow', 'sklearn', 'scipy')),
+}
+
+SNIPPET = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': sorted(sys.modules)}}))
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module, repeat):
+    """
+    :param module: Module name.
+    :param repeat: Number of fresh interpreters to import it in.
+    :return: Best import time in seconds and the loaded top-level packages.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    best = None
+    loaded = set()
+    for _ in range(0, repeat):
+        result = json.loads(
+            subprocess.check_output(
+                [sys.executable, '-c',
+                 SNIPPET.format(module=module)], env=env))
+        best = result['seconds'] if best is None else min(
+            best, result['seconds'])
+        loaded = {name.split('.')[0] for name in result['modules']}
+    return best, loaded
+
+
+def main():
+    """Runs the benchmark and returns the exit status."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', help='Previous JSON report.')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=1.5,
+                        help='Allowed slowdown factor against the baseline.')
+    parser.add_argument('--output', help='JSON report filename.')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)['modules']
+
+    report = {'python': sys.version.split()[0], 'modules': {}}
+    failures = []
+    for module, (budget, forbidden) in MODULES.items():
+        seconds, loaded = measure(module, args.repeat)
+        report['modules'][module] = seconds
+        print('{0:45s} {1:8.3f}s'.format(module, seconds))
+
+        heavy = sorted(loaded.intersection(forbidden))
+        if heavy:
+            failures.append('{0} loads {1}'.format(module, ', '.join(heavy)))
+        if seconds > budget:
+            failures.append('{0} takes {1:.3f}s (budget {2:.3f}s)'.format(
+                module, seconds, budget))
+        if module in baseline and seconds > baseline[module] * args.tolerance:
+            failures.append('{0} takes {1:.3f}s (baseline {2:.3f}s)'.format(
+                module, seconds, baseline[module]))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=4)
+
+    for failure in failures:
+        print('FAIL: ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
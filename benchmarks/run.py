@@ -0,0 +1,305 @@
+"""
+Benchmark suite for the mlchr pipeline stages.
+All data comes from the synthetic glyph generator, so the suite runs
+offline. For every stage and every dataset size it records throughput
+(images/s) and peak traced memory, and writes a machine-readable JSON
+report that can be compared between commits.
+
+Usage: python benchmarks/run.py --sizes 1000 2000 4000 --output bench.json
+       python benchmarks/run.py --baseline old.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import numpy as np
+from PIL import Image
+from mlchr.classifiers.knn import KNNClassifier
+from mlchr.classifiers.template_matching import TemplateMatchingClassifier
+from mlchr.feature_extraction.projections import ProjectionsExtractor
+from mlchr.feature_extraction.subdivisions import SubdivisionsExtractor
+from mlchr.feature_extraction.union import FeatureUnion
+from mlchr.feature_extraction.zones import (AdaptiveZonesExtractor,
+                                            ZonesExtractor)
+from mlchr.normalization.normalize import Normalizer
+from mlchr.utils import synthetic, utils
+from mlchr.utils.image import OCRImage
+
+
+def raw_images(dataset):
+    """
+    :return: OCRImage images at twice the dataset size, to be normalized.
+    """
+    images = []
+    for i in range(0, len(dataset)):
+        pixels = np.kron(dataset[i], np.ones((2, 2), dtype=np.uint8))
+        images.append(
+            OCRImage(Image.fromarray(((1 - pixels) * 255).astype(np.uint8))))
+    return images
+
+
+def stage_read_from_folder(dataset, args):
+    """read_from_folder on PNG files written to a temporary folder."""
+    directory = tempfile.mkdtemp(dir=args.workdir)
+    synthetic.write_folder(dataset, directory)
+    return lambda: utils.read_from_folder({
+        'input_train': directory,
+        'test': False
+    })
+
+
+def stage_pillow_resize(dataset, args):
+    """Normalizer.pillow_resize from twice the size."""
+    images = raw_images(dataset)
+    return lambda: Normalizer(args.image_size).pillow_resize(images)
+
+
+def stage_pillow_resize_batch(dataset, args):
+    """Normalizer.pillow_resize_batch from twice the size."""
+    images = raw_images(dataset)
+    return lambda: Normalizer(args.image_size).pillow_resize_batch(images)
+
+
+def extractor_stage(extractor):
+    """
+    :return: A stage that transforms the dataset with the extractor.
+    """
+
+    def stage(dataset, args):  # pylint: disable=unused-argument
+        pixels = dataset.pixels
+        return lambda: extractor.transform(pixels)
+
+    stage.__doc__ = '{0}.transform'.format(type(extractor).__name__)
+    return stage
+
+
+def held_out(dataset, args):
+    """
+    :param dataset: n + args.queries generated images.
+    :return: The n training images and args.queries held-out images of the
+    same classes.
+    """
+    return dataset.train_test_split(args.queries / len(dataset),
+                                    random_state=args.seed)
+
+
+def stage_template_matching(dataset, args):
+    """TemplateMatchingClassifier.predict of held-out images."""
+    train, queries = held_out(dataset, args)
+    classifier = TemplateMatchingClassifier()
+    classifier.fit(train)
+    return lambda: classifier.predict(queries, dist=args.dist)
+
+
+def stage_template_index(dataset, args):
+    """
+    TemplateMatchingClassifier.predict with the pruned index. Runs with
+    Jaccard, the index does not prune Yule.
+    """
+    train, queries = held_out(dataset, args)
+    classifier = TemplateMatchingClassifier(use_index=True)
+    classifier.fit(train)
+
+    def run():
+        classifier.predict(queries, dist='jaccard')
+
+    run.info = lambda: {
+        'dist': 'jaccard',
+        'pruned_ratio': classifier.index.stats()['pruned_ratio']
+    }
+    return run
+
+
+def stage_knn(dataset, args):
+    """KNNClassifier.predict of held-out images on 4 x 4 zone features."""
+    train, queries = held_out(dataset, args)
+    extractor = ZonesExtractor(max(args.image_size // 4, 1))
+    classifier = KNNClassifier(extractor=extractor)
+    classifier.fit(train)
+    features = extractor.transform(queries)
+    classifier.extractor = None
+    return lambda: classifier.predict(features)
+
+
+def stage_ann_fit(dataset, args):
+    """ANNClassifier.fit for one epoch."""
+    from mlchr.classifiers.ann import ANNClassifier
+    classifier = ANNClassifier(args.classes)
+    return lambda: classifier.fit(dataset, epochs=1)
+
+
+def stage_ann_predict(dataset, args):
+    """ANNClassifier.predict."""
+    from mlchr.classifiers.ann import ANNClassifier
+    classifier = ANNClassifier(args.classes)
+    classifier.fit(dataset[:args.classes], epochs=1)
+    return lambda: classifier.predict(dataset)
+
+
+STAGES = {
+    'read_from_folder': stage_read_from_folder,
+    'pillow_resize': stage_pillow_resize,
+    'pillow_resize_batch': stage_pillow_resize_batch,
+    'zones': extractor_stage(ZonesExtractor(4)),
+    'weighted_zones': extractor_stage(ZonesExtractor(4, is_weighted=True)),
+    'adaptive_zones': extractor_stage(AdaptiveZonesExtractor(4)),
+    'projections': extractor_stage(ProjectionsExtractor(4)),
+    'subdivisions': extractor_stage(SubdivisionsExtractor(3)),
+    'feature_union': extractor_stage(
+        FeatureUnion([
+            ZonesExtractor(4),
+            AdaptiveZonesExtractor(4),
+            ProjectionsExtractor(4),
+            SubdivisionsExtractor(3)
+        ])),
+    'template_matching': stage_template_matching,
+    'template_index': stage_template_index,
+    'knn': stage_knn,
+    'ann_fit': stage_ann_fit,
+    'ann_predict': stage_ann_predict,
+}
+
+# stages whose throughput is measured in queries rather than dataset images
+QUERY_STAGES = ('template_matching', 'template_index', 'knn')
+
+
+def measure(stage, dataset, args):
+    """
+    :return: Best wall time of args.repeat runs, peak traced memory and
+    the extra result fields of the stage (run.info).
+    """
+    seconds = None
+    for _ in range(0, args.repeat):
+        run = stage(dataset, args)
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    run = stage(dataset, args)
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, run.info() if hasattr(run, 'info') else {}
+
+
+def git_commit():
+    """
+    :return: Current git commit, None outside a git checkout.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(
+                                           os.path.abspath(__file__))).decode(
+                                           ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """
+    Prints the speedup of every (stage, n) against a baseline report.
+    """
+    previous = {(r['stage'], r['n']): r for r in baseline['results']}
+    for result in report['results']:
+        old = previous.get((result['stage'], result['n']))
+        if old and old.get('seconds') and result.get('seconds'):
+            print('{0:22s} n={1:<8d} speedup {2:6.2f}x'.format(
+                result['stage'], result['n'],
+                old['seconds'] / result['seconds']))
+
+
+def main():
+    """Runs the benchmark suite."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs='+',
+                        default=[1000, 2000, 4000],
+                        help='Dataset sizes of the scaling curves.')
+    parser.add_argument('--image-size', type=int, default=28)
+    parser.add_argument('--classes', type=int, default=10)
+    parser.add_argument('--queries',
+                        type=int,
+                        default=200,
+                        help='Held-out test images of the classifier '
+                        'stages.')
+    parser.add_argument('--dist', default='yule')
+    parser.add_argument('--stages', nargs='+', choices=sorted(STAGES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON report filename.')
+    parser.add_argument('--baseline', help='JSON report to compare with.')
+    args = parser.parse_args()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'image_size': args.image_size,
+            'classes': args.classes,
+            'queries': args.queries,
+            'dist': args.dist,
+            'repeat': args.repeat,
+            'seed': args.seed
+        },
+        'results': []
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = workdir
+        for name in args.stages or list(STAGES):
+            for n in args.sizes:
+                # query stages hold their queries out of the same dataset
+                total = n + args.queries if name in QUERY_STAGES else n
+                dataset = synthetic.make_glyphs(total,
+                                                size=args.image_size,
+                                                n_classes=args.classes,
+                                                random_state=args.seed)
+                result = {'stage': name, 'n': n}
+                try:
+                    seconds, peak, info = measure(STAGES[name], dataset,
+                                                  args)
+                except ImportError as error:
+                    result['skipped'] = str(error)
+                    print('{0:22s} n={1:<8d} skipped ({2})'.format(
+                        name, n, error))
+                    report['results'].append(result)
+                    break
+
+                items = args.queries if name in QUERY_STAGES else n
+                result.update({
+                    'seconds': seconds,
+                    'images_per_second': items / seconds,
+                    'peak_bytes': peak
+                })
+                result.update(info)
+                report['results'].append(result)
+                print('{0:22s} n={1:<8d} {2:12.1f} images/s {3:10.1f} MiB'
+                      .format(name, n, items / seconds, peak / 2**20))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            compare(report, json.load(fp))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,57 +1,208 @@
-"""This module contains an Artificial Neural Network classifier."""
-import tensorflow as tf
+"""
+This module contains an Artificial Neural Network classifier.
+TensorFlow is imported on first use, so importing this module is cheap.
+"""
+import numpy as np
+from mlchr.classifiers import numpy_ann
+from mlchr.utils import profiling
+from mlchr.utils.dataset import stratified_split
+from mlchr.utils.image import as_batch
+
+
+def make_dataset(x, y=None, batch_size=64, shuffle=False, cache=False):
+    """
+    :param x: A 3d numpy array of images.
+    :param y: Target classes of the images.
+    :param batch_size: Batch size.
+    :param shuffle: Shuffle all images on every epoch.
+    :param cache: Cache the dataset in memory after the first epoch.
+    :return: A tf.data.Dataset of float32 image batches.
+    """
+    import tensorflow as tf
+
+    dataset = tf.data.Dataset.from_tensor_slices(x if y is None else (x, y))
+    if cache:
+        dataset = dataset.cache()
+    if shuffle:
+        # the buffer holds every image, folder data is sorted by class
+        dataset = dataset.shuffle(len(x), reshuffle_each_iteration=True)
+
+    def to_float(images, *target):
+        return (tf.cast(images, tf.float32), ) + target
+
+    dataset = dataset.batch(batch_size).map(
+        to_float, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
 
 
 class ANNClassifier:
-    """CNNClassifier"""
+    """ANNClassifier"""
 
-    def __init__(self, num_of_classes, learning_rate=0.01):
+    def __init__(self, num_of_classes, learning_rate=0.01, optimizer='sgd'):
         """
         :param num_of_classes: Number of target classes.
-        :param learning_rate: Learning rate for GradientDescentOptimizer.
+        :param learning_rate: Learning rate of the optimizer.
+        :param optimizer: Keras optimizer name (e.g. 'sgd', 'adam') or
+        instance.
         """
+        import tensorflow as tf
 
+        self.num_of_classes = num_of_classes
         self.learning_rate = learning_rate
         self.model = tf.keras.models.Sequential([
             tf.keras.layers.Flatten(),
-            tf.keras.layers.Dense(784, activation=tf.nn.relu),
+            tf.keras.layers.Dense(784, activation='relu'),
             tf.keras.layers.Dropout(0.2),
-            tf.keras.layers.Dense(2000, activation=tf.nn.relu),
+            tf.keras.layers.Dense(2000, activation='relu'),
             tf.keras.layers.Dropout(0.5),
-            tf.keras.layers.Dense(2000, activation=tf.nn.relu),
+            tf.keras.layers.Dense(2000, activation='relu'),
             tf.keras.layers.Dropout(0.5),
-            tf.keras.layers.Dense(num_of_classes, activation=tf.nn.softmax)
+            tf.keras.layers.Dense(num_of_classes, activation='softmax')
         ])
 
+        if isinstance(optimizer, str):
+            optimizer = tf.keras.optimizers.get({
+                'class_name': optimizer,
+                'config': {
+                    'learning_rate': learning_rate
+                }
+            })
+
         # set model configurations
-        self.model.compile(optimizer=tf.train.GradientDescentOptimizer(
-            learning_rate=self.learning_rate),
+        self.model.compile(optimizer=optimizer,
                            loss='sparse_categorical_crossentropy',
                            metrics=['accuracy'])
 
-    def fit(self, x, y, epochs=10, batch_size=64, verbose=0):
+    def fit(self,
+            x,
+            y=None,
+            epochs=10,
+            batch_size=64,
+            verbose=0,
+            validation_split=0.0,
+            patience=None,
+            cache=False,
+            random_state=None):
         """
-        :param x: A list of 2d numpy arrays that represent pixel values(0/1).
-        :param y: A list of the corresponding target classes for the images.
+        :param x: A list of 2d numpy arrays that represent pixel values(0/1),
+        a 3d numpy array or an OCRDataset.
+        :param y: A list of the corresponding target classes for the images
+        (defaults to the labels of an OCRDataset).
         :param epochs: Training epochs.
+        :param batch_size: Batch size.
+        :param verbose: Keras verbosity.
+        :param validation_split: Fraction of the images of each class held
+        out for validation, chosen at random.
+        :param patience: Stop after this many epochs without improvement of
+        the (validation) loss and keep the best weights.
+        :param cache: Cache the training set in memory after the first epoch.
+        :param random_state: Seed of the validation split.
+        :return: Keras training history.
         """
+        import tensorflow as tf
 
-        self.model.fit(x,
-                       y,
-                       batch_size=batch_size,
-                       epochs=epochs,
-                       verbose=verbose)
+        if y is None:
+            y = x.labels
+        x = as_batch(x)
+        y = np.asarray(y)
+
+        validation = None
+        if validation_split:
+            train, test = stratified_split(len(x), y, validation_split,
+                                           random_state)
+            validation = make_dataset(x[test], y[test], batch_size)
+            x, y = x[train], y[train]
+
+        callbacks = []
+        if patience is not None:
+            callbacks.append(
+                tf.keras.callbacks.EarlyStopping(
+                    monitor='loss' if validation is None else 'val_loss',
+                    patience=patience,
+                    restore_best_weights=True))
+
+        with profiling.stage('ANNClassifier.fit') as stage:
+            history = self.model.fit(make_dataset(x,
+                                                  y,
+                                                  batch_size,
+                                                  shuffle=True,
+                                                  cache=cache),
+                                     validation_data=validation,
+                                     epochs=epochs,
+                                     callbacks=callbacks,
+                                     verbose=verbose)
+            # images seen, early stopping may end before the last epoch
+            stage.update(items=len(x) * len(history.epoch),
+                         epochs=len(history.epoch))
+        return history
+
+    def predict_proba(self, x_test, batch_size=1024):
+        """
+        :param x_test: A list of 2d numpy arrays that holds images, a 3d
+        numpy array or an OCRDataset.
+        :param batch_size: Batch size.
+        :return: A numpy array of class probabilities for each image.
+        """
+        x_test = as_batch(x_test)
+        with profiling.stage('ANNClassifier.predict', items=len(x_test)):
+            return self.model.predict(make_dataset(x_test,
+                                                   batch_size=batch_size),
+                                      verbose=0)
 
-    def predict(self, x_test):
+    def predict(self, x_test, batch_size=1024, return_proba=False):
         """
-        :param x_test: A list of 2d numpy arrays that holds images.
-        :return: A list with the predicted target classes.
+        :param x_test: A list of 2d numpy arrays that holds images, a 3d
+        numpy array or an OCRDataset.
+        :param batch_size: Batch size.
+        :param return_proba: Also return the class probabilities.
+        :return: A numpy array with the predicted target classes (and the
+        class probabilities if return_proba=True).
         """
 
-        preds = self.model.predict(x_test)
-        y = []
-        for pred in preds:
-            y.append(pred.argmax(axis=0))
+        proba = self.predict_proba(x_test, batch_size)
+        y = proba.argmax(axis=1)
 
         # return predictions
-        return y
+        return (y, proba) if return_proba else y
+
+    def export(self, filename, quantize=False):
+        """
+        Exports the dense layer weights for NumpyANNClassifier.
+        :param filename: Output .npz filename.
+        :param quantize: Store kernels as int8 with per-unit scales (lossy,
+        see numpy_ann.save_weights).
+        """
+        import tensorflow as tf
+
+        dense = [
+            layer for layer in self.model.layers
+            if isinstance(layer, tf.keras.layers.Dense)
+        ]
+        numpy_ann.save_weights(filename,
+                               [layer.get_weights()[0] for layer in dense],
+                               [layer.get_weights()[1] for layer in dense],
+                               [layer.get_config()['activation']
+                                for layer in dense],
+                               quantize=quantize)
+
+    def save(self, filename):
+        """
+        :param filename: Model filename (.keras or .h5).
+        """
+        self.model.save(filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        :param filename: Model filename saved by ANNClassifier.save.
+        :return: An ANNClassifier instance.
+        """
+        import tensorflow as tf
+
+        classifier = cls.__new__(cls)
+        classifier.model = tf.keras.models.load_model(filename)
+        classifier.num_of_classes = classifier.model.layers[-1].units
+        classifier.learning_rate = float(
+            tf.keras.backend.get_value(
+                classifier.model.optimizer.learning_rate))
+        return classifier
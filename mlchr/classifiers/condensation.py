@@ -0,0 +1,178 @@
+"""
+This module contains template set condensation. It selects a subset of
+the templates of a TemplateMatchingClassifier that classifies (nearly) as
+well as the full set, using the same Yule/Jaccard distances.
+"""
+import copy
+import time
+import numpy as np
+from mlchr.classifiers import distances
+
+
+def pairwise(packed, counts, n_bits, dist='yule', batch_size=64):
+    """
+    :param packed: Packed images (m x words uint64).
+    :param counts: Foreground pixel counts of the images.
+    :param n_bits: Number of pixels per image.
+    :param dist: Distance ('yule' or 'jaccard').
+    :param batch_size: Number of rows computed at a time.
+    :return: Dissimilarity matrix (m x m).
+    """
+    d = np.empty((len(packed), len(packed)))
+    for start in range(0, len(packed), batch_size):
+        stop = start + batch_size
+        d[start:stop] = distances.dissimilarity(packed[start:stop],
+                                                counts[start:stop], packed,
+                                                counts, n_bits, dist)
+    return d
+
+
+def condensed_nearest_neighbour(packed,
+                                counts,
+                                n_bits,
+                                y,
+                                dist='yule',
+                                batch_size=256,
+                                max_passes=10,
+                                random_state=0):
+    """
+    Hart's condensed nearest neighbour. Starting from one template per
+    class, templates misclassified by the selected ones are added until a
+    pass adds none. Templates are visited in batches, all misclassified
+    templates of a batch are added at once.
+    :param packed: Packed templates (m x words uint64).
+    :param counts: Foreground pixel counts of the templates.
+    :param n_bits: Number of pixels per image.
+    :param y: Target classes of the templates.
+    :param dist: Distance ('yule' or 'jaccard').
+    :param batch_size: Number of templates classified at a time.
+    :param max_passes: Maximum number of passes over the templates.
+    :param random_state: Seed of the visiting order.
+    :return: Sorted indices of the selected templates.
+    """
+    y = np.asarray(y)
+    order = np.random.RandomState(random_state).permutation(len(y))
+    _, first = np.unique(y[order], return_index=True)
+    selected = np.zeros(len(y), dtype=bool)
+    selected[order[first]] = True
+
+    for _ in range(0, max_passes):
+        added = 0
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            batch = batch[~selected[batch]]
+            if not len(batch):
+                continue
+            kept = np.flatnonzero(selected)
+            idx, _ = distances.nearest(packed[batch], counts[batch],
+                                       packed[kept], counts[kept], n_bits,
+                                       dist)
+            wrong = batch[y[kept[idx]] != y[batch]]
+            selected[wrong] = True
+            added += len(wrong)
+        if not added:
+            break
+
+    return np.flatnonzero(selected)
+
+
+def class_medoids(packed,
+                  counts,
+                  n_bits,
+                  y,
+                  n_per_class=10,
+                  dist='yule',
+                  sample_size=2000,
+                  n_iter=10,
+                  random_state=0):
+    """
+    Selects k medoids per class: farthest-first initialization followed by
+    alternating assignment and medoid updates.
+    :param packed: Packed templates (m x words uint64).
+    :param counts: Foreground pixel counts of the templates.
+    :param n_bits: Number of pixels per image.
+    :param y: Target classes of the templates.
+    :param n_per_class: Medoids per class.
+    :param dist: Distance ('yule' or 'jaccard').
+    :param sample_size: Templates per class the medoids are chosen from.
+    :param n_iter: Maximum number of medoid updates.
+    :param random_state: Seed of the sampling.
+    :return: Sorted indices of the selected templates.
+    """
+    rng = np.random.RandomState(random_state)
+    y = np.asarray(y)
+    selected = []
+    for label in np.unique(y):
+        members = np.flatnonzero(y == label)
+        if len(members) > sample_size:
+            members = np.sort(rng.choice(members, sample_size, replace=False))
+        if len(members) <= n_per_class:
+            selected.extend(members)
+            continue
+
+        d = pairwise(packed[members], counts[members], n_bits, dist)
+        medoids = [int(d.sum(axis=1).argmin())]
+        nearest = d[medoids[0]].copy()
+        while len(medoids) < n_per_class:
+            medoids.append(int(nearest.argmax()))
+            np.minimum(nearest, d[medoids[-1]], out=nearest)
+
+        for _ in range(0, n_iter):
+            assignment = d[:, medoids].argmin(axis=1)
+            updated = []
+            for k, medoid in enumerate(medoids):
+                cluster = np.flatnonzero(assignment == k)
+                updated.append(
+                    int(cluster[d[np.ix_(cluster, cluster)].sum(
+                        axis=1).argmin()]) if len(cluster) else medoid)
+            if updated == medoids:
+                break
+            medoids = updated
+
+        selected.extend(members[medoids])
+
+    return np.unique(np.asarray(selected, dtype=np.int64))
+
+
+METHODS = {'cnn': condensed_nearest_neighbour, 'medoids': class_medoids}
+
+
+def condensation_report(classifier,
+                        x_test,
+                        y_test,
+                        methods=None,
+                        dist='yule',
+                        params=None):
+    """
+    Condenses copies of a fitted classifier and measures the accuracy and
+    prediction time of each on a held-out split.
+    :param classifier: A fitted TemplateMatchingClassifier.
+    :param x_test: Held-out images.
+    :param y_test: Target classes of the held-out images.
+    :param methods: Condensation method names (all by default).
+    :param dist: Distance ('yule' or 'jaccard').
+    :param params: Keyword arguments of each method, e.g.
+    {'medoids': {'n_per_class': 20}}.
+    :return: A list of dicts with the method, number of templates, size
+    ratio, accuracy and prediction seconds. The first is the full set.
+    """
+    y_test = np.asarray(y_test)
+    candidates = [(None, classifier)]
+    for method in methods or sorted(METHODS):
+        condensed = copy.deepcopy(classifier)
+        condensed.condense(method, dist, **(params or {}).get(method, {}))
+        candidates.append((method, condensed))
+
+    report = []
+    for method, candidate in candidates:
+        start = time.perf_counter()
+        y_pred = np.asarray(candidate.predict(x_test, dist=dist))
+        seconds = time.perf_counter() - start
+        report.append({
+            'method': method,
+            'templates': len(candidate.X),
+            'ratio': len(candidate.X) / len(classifier.X),
+            'accuracy': float(np.mean(y_pred == y_test)),
+            'seconds': seconds
+        })
+    return report
@@ -0,0 +1,139 @@
+"""
+This module contains a bit-packed engine for binary image dissimilarities.
+Images are packed into uint64 words once and the contingency counts
+(NTT, NTF, NFT, NFF) of whole (query x template) blocks are computed with
+popcounts, giving the same values as scipy.spatial.distance.yule/jaccard.
+"""
+import numpy as np
+from mlchr.utils.image import as_batch
+
+# popcount lookup table for numpy versions without np.bitwise_count
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)],
+                           dtype=np.uint8)
+
+# max number of uint64 words held by a single (query x template) block
+_BLOCK_WORDS = 1 << 22
+
+
+def pack_bits(x):
+    """
+    :param x: A list of 2d numpy arrays, a numpy array of images or an
+    OCRDataset.
+    :return: Packed images (N x words uint64), foreground pixel counts
+    and number of pixels per image.
+    """
+    if isinstance(x, np.ndarray) and x.ndim == 2:
+        flat = x != 0
+    else:
+        x = as_batch(x)
+        flat = x.reshape(len(x), int(np.prod(x.shape[1:]))) != 0
+
+    n_bits = flat.shape[1]
+    packed = np.packbits(flat, axis=1)
+
+    # pad bytes to whole uint64 words
+    packed = np.pad(packed, ((0, 0), (0, -packed.shape[1] % 8)))
+    packed = np.ascontiguousarray(packed).view(np.uint64)
+
+    counts = flat.sum(axis=1, dtype=np.int64)
+    return packed, counts, n_bits
+
+
+def popcount(words):
+    """
+    :param words: A numpy array of uint64 words.
+    :return: Number of set bits, summed over the last axis.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    as_bytes = words.view(np.uint8)
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=-1, dtype=np.int64)
+
+
+def contingency(q_packed, q_counts, t_packed, t_counts, n_bits):
+    """
+    :param q_packed: Packed query images (b x words).
+    :param q_counts: Foreground pixel counts of the queries.
+    :param t_packed: Packed template images (m x words).
+    :param t_counts: Foreground pixel counts of the templates.
+    :param n_bits: Number of pixels per image.
+    :return: NTT, NTF, NFT and NFF count matrices (b x m).
+    """
+    ntt = popcount(q_packed[:, np.newaxis, :] & t_packed[np.newaxis, :, :])
+    ntf = q_counts[:, np.newaxis] - ntt
+    nft = t_counts[np.newaxis, :] - ntt
+    nff = n_bits - ntt - ntf - nft
+    return ntt, ntf, nft, nff
+
+
+def yule(ntt, ntf, nft, nff):
+    """
+    :return: Yule dissimilarity from contingency counts.
+    """
+    half_r = ntf * nft
+    denominator = ntt * nff + half_r
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d = 2.0 * half_r / denominator
+    return np.where(half_r == 0, 0.0, d)
+
+
+def jaccard(ntt, ntf, nft, nff):
+    """
+    :return: Jaccard dissimilarity from contingency counts.
+    """
+    unequal = ntf + nft
+    nonzero = ntt + unequal
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d = unequal / nonzero
+    return np.where(nonzero == 0, 0.0, d)
+
+
+DISTANCES = {'yule': yule, 'jaccard': jaccard}
+
+
+def dissimilarity(q_packed, q_counts, t_packed, t_counts, n_bits, dist):
+    """
+    :return: Dissimilarity matrix (b x m) between queries and templates.
+    """
+    return DISTANCES[dist](
+        *contingency(q_packed, q_counts, t_packed, t_counts, n_bits))
+
+
+def nearest(q_packed,
+            q_counts,
+            t_packed,
+            t_counts,
+            n_bits,
+            dist='yule',
+            batch_size=64):
+    """
+    Finds the nearest template of every query. Ties are resolved to the
+    first template, as in a sequential scan.
+    :param dist: Distance ('yule' or 'jaccard').
+    :param batch_size: Number of queries compared at a time.
+    :return: Indices of the nearest templates and their dissimilarities.
+    """
+    n_queries = len(q_packed)
+    best_idx = np.zeros(n_queries, dtype=np.int64)
+    best_dist = np.full(n_queries, np.inf)
+    if not len(t_packed):
+        raise ValueError('No templates to compare against.')
+
+    words = max(q_packed.shape[1], 1)
+    for start in range(0, n_queries, batch_size):
+        stop = min(start + batch_size, n_queries)
+        block = max(_BLOCK_WORDS // ((stop - start) * words), 1)
+        for t_start in range(0, len(t_packed), block):
+            t_stop = min(t_start + block, len(t_packed))
+            d = dissimilarity(q_packed[start:stop], q_counts[start:stop],
+                              t_packed[t_start:t_stop],
+                              t_counts[t_start:t_stop], n_bits, dist)
+            idx = d.argmin(axis=1)
+            d = d[np.arange(len(d)), idx]
+
+            # strict comparison keeps the earliest template on ties
+            better = d < best_dist[start:stop]
+            best_dist[start:stop][better] = d[better]
+            best_idx[start:stop][better] = idx[better] + t_start
+
+    return best_idx, best_dist
@@ -0,0 +1,130 @@
+"""
+This module contains a k nearest neighbours classifier over extracted
+feature vectors. Neighbours are found through a KD-tree built in fit, so
+on low dimensional features (e.g. zones) a query visits only a few leaves
+instead of every training sample.
+SciPy is imported on first use.
+"""
+import numpy as np
+from mlchr.utils import profiling
+
+# Minkowski p of the supported metrics
+METRICS = {'euclidean': 2, 'manhattan': 1, 'chebyshev': np.inf}
+
+
+class KNNClassifier:
+    """KNNClassifier"""
+
+    def __init__(self,
+                 n_neighbors=1,
+                 metric='euclidean',
+                 extractor=None,
+                 leafsize=16,
+                 batch_size=4096,
+                 n_jobs=1):
+        """
+        :param n_neighbors: Number of neighbours that vote.
+        :param metric: 'euclidean', 'manhattan' or 'chebyshev'.
+        :param extractor: A BaseExtractor instance that transforms images
+        into features (None if fit and predict get feature vectors).
+        :param leafsize: Number of samples at which the tree stops
+        splitting.
+        :param batch_size: Number of queries searched at a time.
+        :param n_jobs: Number of threads per batch (-1 for all cores).
+        """
+        if metric not in METRICS:
+            raise KeyError(metric)
+        self.n_neighbors = n_neighbors
+        self.metric = metric
+        self.extractor = extractor
+        self.leafsize = leafsize
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.tree = None
+        self.classes = None
+        self.class_ids = None
+
+    def features(self, x):
+        """
+        :param x: Feature vectors (N x n_features), or images if the
+        classifier has an extractor.
+        :return: A float64 numpy array of feature vectors.
+        """
+        if self.extractor is not None:
+            x = self.extractor.transform(x)
+        x = np.asarray(x, dtype=np.float64)
+        if x.ndim != 2:
+            raise ValueError('Expected an (N, n_features) array.')
+        return x
+
+    def fit(self, x, y=None):
+        """
+        :param x: Feature vectors (N x n_features), or images (a list of 2d
+        numpy arrays, a 3d numpy array or an OCRDataset) if the classifier
+        has an extractor.
+        :param y: A list of the corresponding target classes (defaults to
+        the labels of an OCRDataset).
+        """
+        from scipy.spatial import cKDTree
+
+        if y is None:
+            y = x.labels
+        with profiling.stage('KNNClassifier.fit', items=len(y)) as stage:
+            if self.extractor is not None:
+                self.extractor.fit(x)
+            features = self.features(x)
+            self.classes, class_ids = np.unique(np.asarray(y),
+                                                return_inverse=True)
+            self.class_ids = class_ids.ravel()
+            if self.n_neighbors > len(features):
+                raise ValueError(
+                    'n_neighbors={0} exceeds the {1} training samples.'.format(
+                        self.n_neighbors, len(features)))
+            self.tree = cKDTree(features, leafsize=self.leafsize)
+            stage.update(nbytes=features.nbytes)
+
+    def kneighbors(self, x, n_neighbors=None):
+        """
+        :param x: Feature vectors, or images if the classifier has an
+        extractor.
+        :param n_neighbors: Number of neighbours (the classifier's by
+        default).
+        :return: Distances and indices of the nearest training samples
+        (N x n_neighbors), nearest first.
+        """
+        k = n_neighbors or self.n_neighbors
+        if k > self.tree.n:
+            raise ValueError(
+                'n_neighbors={0} exceeds the {1} training samples.'.format(
+                    k, self.tree.n))
+        features = self.features(x)
+        dist = np.empty((len(features), k))
+        idx = np.empty((len(features), k), dtype=np.int64)
+        for start in range(0, len(features), self.batch_size):
+            stop = start + self.batch_size
+            d, i = self.tree.query(features[start:stop],
+                                   k=list(range(1, k + 1)),
+                                   p=METRICS[self.metric],
+                                   workers=self.n_jobs)
+            dist[start:stop], idx[start:stop] = d, i
+        return dist, idx
+
+    def predict(self, x_test):
+        """
+        :param x_test: Feature vectors, or images if the classifier has an
+        extractor.
+        :return: A numpy array with the predicted target classes. Ties go
+        to the class with the nearer neighbours.
+        """
+        with profiling.stage('KNNClassifier.predict', items=len(x_test)):
+            _, idx = self.kneighbors(x_test)
+            votes = self.class_ids[idx]
+            k = votes.shape[1]
+
+            # one vote per neighbour plus a bonus below one vote in total
+            # that favours nearer neighbours
+            weights = 1 + (k - np.arange(k)) / (k * k + 1)
+            scores = np.zeros((len(votes), len(self.classes)))
+            np.add.at(scores, (np.arange(len(votes))[:, np.newaxis], votes),
+                      weights)
+            return self.classes[scores.argmax(axis=1)]
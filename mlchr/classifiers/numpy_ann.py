@@ -0,0 +1,125 @@
+"""
+This module contains a NumPy inference engine for ANNClassifier models
+exported with ANNClassifier.export. It does not import TensorFlow.
+"""
+import numpy as np
+from mlchr.utils import profiling
+from mlchr.utils.image import as_batch
+
+
+def relu(x):
+    """relu"""
+    return np.maximum(x, 0, out=x)
+
+
+def softmax(x):
+    """softmax"""
+    x -= x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+def linear(x):
+    """linear"""
+    return x
+
+
+ACTIVATIONS = {'relu': relu, 'softmax': softmax, 'linear': linear}
+
+
+def save_weights(filename, kernels, biases, activations, quantize=False):
+    """
+    :param filename: Output .npz filename.
+    :param kernels: Kernels of the dense layers.
+    :param biases: Biases of the dense layers.
+    :param activations: Activation names of the dense layers.
+    :param quantize: Store kernels as int8 with one float32 scale per
+    output unit. float32 kernels give the Keras probabilities to about
+    1e-7. int8 kernels are lossy: probabilities may differ by about 1e-3,
+    and the predicted class may change for images near a class boundary.
+    """
+    arrays = {'activations': np.array(activations)}
+    for i, (kernel, bias) in enumerate(zip(kernels, biases)):
+        kernel = np.asarray(kernel, dtype=np.float32)
+        if quantize:
+            scale = np.abs(kernel).max(axis=0) / 127
+            scale[scale == 0] = 1
+            arrays['kernel_{0}'.format(i)] = np.round(kernel / scale).astype(
+                np.int8)
+            arrays['scale_{0}'.format(i)] = scale.astype(np.float32)
+        else:
+            arrays['kernel_{0}'.format(i)] = kernel
+        arrays['bias_{0}'.format(i)] = np.asarray(bias, dtype=np.float32)
+    np.savez_compressed(filename, **arrays)
+
+
+class NumpyANNClassifier:
+    """NumpyANNClassifier"""
+
+    def __init__(self, kernels, biases, activations):
+        """
+        :param kernels: float32 kernels of the dense layers.
+        :param biases: float32 biases of the dense layers.
+        :param activations: Activation names of the dense layers.
+        """
+        self.kernels = kernels
+        self.biases = biases
+        self.activations = [ACTIVATIONS[name] for name in activations]
+
+    @classmethod
+    def load(cls, filename):
+        """
+        :param filename: A .npz file written by ANNClassifier.export.
+        :return: A NumpyANNClassifier instance.
+        """
+        with np.load(filename) as arrays:
+            activations = [str(name) for name in arrays['activations']]
+            kernels, biases = [], []
+            for i in range(0, len(activations)):
+                kernel = arrays['kernel_{0}'.format(i)].astype(np.float32)
+                if 'scale_{0}'.format(i) in arrays:
+                    kernel *= arrays['scale_{0}'.format(i)]
+                kernels.append(kernel)
+                biases.append(arrays['bias_{0}'.format(i)])
+        return cls(kernels, biases, activations)
+
+    def predict_proba(self, x_test, batch_size=1024):
+        """
+        :param x_test: A list of 2d numpy arrays that holds images, a 3d
+        numpy array or an OCRDataset.
+        :param batch_size: Batch size.
+        :return: A numpy array of class probabilities for each image.
+        """
+        x_test = as_batch(x_test)
+        x_test = x_test.reshape(len(x_test), -1)
+        proba = np.empty((len(x_test), len(self.biases[-1])),
+                         dtype=np.float32)
+
+        with profiling.stage('NumpyANNClassifier.predict',
+                             items=len(x_test)):
+            for start in range(0, len(x_test), batch_size):
+                stop = start + batch_size
+                x = x_test[start:stop].astype(np.float32)
+                for kernel, bias, activation in zip(self.kernels,
+                                                    self.biases,
+                                                    self.activations):
+                    x = x @ kernel
+                    x += bias
+                    x = activation(x)
+                proba[start:stop] = x
+
+        return proba
+
+    def predict(self, x_test, batch_size=1024, return_proba=False):
+        """
+        :param x_test: A list of 2d numpy arrays that holds images, a 3d
+        numpy array or an OCRDataset.
+        :param batch_size: Batch size.
+        :param return_proba: Also return the class probabilities.
+        :return: A numpy array with the predicted target classes (and the
+        class probabilities if return_proba=True).
+        """
+        proba = self.predict_proba(x_test, batch_size)
+        y = proba.argmax(axis=1)
+        return (y, proba) if return_proba else y
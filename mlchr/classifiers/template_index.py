@@ -0,0 +1,258 @@
+"""
+This module contains a pruned nearest-template index.
+A few medoid templates per class serve as pivots, and every other non-empty
+template is assigned to its nearest pivot. For Jaccard (a metric), the
+distance to a pivot minus the pivot's radius bounds the distance to every
+template of its cluster from below, and the counts a and b of a query and
+a template bound their distance by 1 - min(a, b) / max(a, b). Clusters are
+visited nearest first, each with the queries its bounds cannot rule out.
+Yule has no such bounds, so exact Yule queries run a batched full scan.
+"""
+import numpy as np
+from mlchr.classifiers import condensation, distances
+
+# slack added to bounds so rounding never prunes a tied template
+_EPS = 1e-9
+
+# number of uint64 words a (query x cluster) block is sized for
+_BLOCK_WORDS = 1 << 18
+
+
+class TemplateIndex:
+    """TemplateIndex"""
+
+    def __init__(self,
+                 packed,
+                 counts,
+                 n_bits,
+                 y,
+                 prototypes=True,
+                 n_prototypes=8,
+                 sample_size=256):
+        """
+        :param packed: Packed templates (m x words uint64).
+        :param counts: Foreground pixel counts of the templates.
+        :param n_bits: Number of pixels per image.
+        :param y: Target classes of the templates.
+        :param prototypes: Select per-class medoid templates as pivots
+        (without them every search is a full scan).
+        :param n_prototypes: Pivots per class.
+        :param sample_size: Templates per class the pivots are chosen from.
+        """
+        self.n_bits = n_bits
+        self.templates = (packed, counts)
+
+        # class of every template
+        self.classes, class_ids = np.unique(np.asarray(y),
+                                            return_inverse=True)
+        self.class_ids = class_ids.ravel()
+
+        self.prototypes = None
+        self.prototype_classes = None
+        self.radius = None
+        self.clusters = None
+        if prototypes:
+            self._build_prototypes(n_prototypes, sample_size)
+
+        self.n_comparisons = 0
+        self.n_prototype_comparisons = 0
+        self.n_pruned = 0
+
+    def _build_prototypes(self, n_prototypes, sample_size):
+        """
+        Selects medoid templates of every class as pivots (never an empty
+        template) and assigns every non-empty template to its nearest
+        pivot. The empty templates form one more cluster without a pivot.
+        """
+        packed, counts = self.templates
+        nonempty = np.flatnonzero(counts > 0)
+        if not len(nonempty):
+            return
+        pivots = nonempty[condensation.class_medoids(packed[nonempty],
+                                                     counts[nonempty],
+                                                     self.n_bits,
+                                                     self.class_ids[nonempty],
+                                                     n_prototypes,
+                                                     'jaccard',
+                                                     sample_size)]
+        self.prototypes = (packed[pivots], counts[pivots])
+        self.prototype_classes = self.class_ids[pivots]
+
+        assignment, d = distances.nearest(packed[nonempty], counts[nonempty],
+                                          self.prototypes[0],
+                                          self.prototypes[1], self.n_bits,
+                                          'jaccard')
+        self.radius = np.zeros(len(pivots))
+        np.maximum.at(self.radius, assignment, d)
+
+        # members of every cluster and their distances to its pivot
+        self.clusters = [(nonempty[assignment == k], d[assignment == k])
+                         for k in range(len(pivots))]
+        empty = np.flatnonzero(counts == 0)
+        self.clusters.append((empty, np.zeros(len(empty))))
+
+    def stats(self):
+        """
+        :return: Comparison and pruning counters of the queries so far.
+        Template comparisons plus pruned templates add up to the number of
+        templates per query, prototype comparisons are counted apart.
+        """
+        total = self.n_comparisons + self.n_pruned
+        return {
+            'comparisons': self.n_comparisons,
+            'prototype_comparisons': self.n_prototype_comparisons,
+            'pruned': self.n_pruned,
+            'pruned_ratio': self.n_pruned / total if total else 0.0
+        }
+
+    def query(self,
+              q_packed,
+              q_counts,
+              dist='yule',
+              exact=True,
+              n_classes=3,
+              batch_size=64):
+        """
+        :param q_packed: Packed query images (b x words).
+        :param q_counts: Foreground pixel counts of the queries.
+        :param dist: Distance ('yule' or 'jaccard').
+        :param exact: Return the same templates as a full scan. Otherwise
+        only templates of the n_classes classes with the nearest pivots
+        (by Jaccard distance) are compared.
+        :param n_classes: Classes searched when exact is False.
+        :param batch_size: Number of queries compared at a time.
+        :return: Indices of the nearest templates and their dissimilarities.
+        """
+        if not exact and self.prototypes is None:
+            raise ValueError('Approximate search requires prototypes.')
+        if not exact:
+            return self._query_classes(q_packed, q_counts, dist, n_classes,
+                                       batch_size)
+        if dist == 'jaccard' and self.prototypes is not None:
+            return self._query_clusters(q_packed, q_counts, batch_size)
+
+        # nothing can be pruned, scan the templates in original order
+        self.n_comparisons += len(q_packed) * len(self.class_ids)
+        return distances.nearest(q_packed, q_counts, self.templates[0],
+                                 self.templates[1], self.n_bits, dist,
+                                 batch_size)
+
+    def _prototype_distances(self, q_packed, q_counts):
+        """
+        :return: Jaccard distances of the queries to the pivots.
+        """
+        self.n_prototype_comparisons += len(q_packed) * len(
+            self.prototypes[1])
+        return distances.dissimilarity(q_packed, q_counts,
+                                       self.prototypes[0],
+                                       self.prototypes[1], self.n_bits,
+                                       'jaccard')
+
+    def _nearest(self, q_packed, q_counts, members, dist, batch_size):
+        """
+        :param members: Template indices.
+        :return: Indices of the nearest members (first in the original
+        order on ties) and their dissimilarities.
+        """
+        members = np.sort(members)
+
+        # small clusters take more queries per block
+        batch_size = max(batch_size,
+                         _BLOCK_WORDS // (len(members) * q_packed.shape[1]))
+        idx, d = distances.nearest(q_packed, q_counts,
+                                   self.templates[0][members],
+                                   self.templates[1][members], self.n_bits,
+                                   dist, batch_size)
+        return members[idx], d
+
+    def _query_clusters(self, q_packed, q_counts, batch_size):
+        """
+        Exact Jaccard search, visiting the clusters nearest first.
+        :return: Indices of the nearest templates and their dissimilarities.
+        """
+        n_queries = len(q_packed)
+        best_idx = np.full(n_queries, len(self.class_ids), dtype=np.int64)
+        best_dist = np.full(n_queries, np.inf)
+
+        # lower bound per (query, cluster): J(q, P) - radius, and for the
+        # empty templates 1 (0 for an empty query)
+        proto_d = self._prototype_distances(q_packed, q_counts)
+        bounds = np.hstack([
+            proto_d - self.radius, (q_counts > 0)[:, np.newaxis].astype(float)
+        ])
+
+        comparisons = 0
+        for k in np.argsort(bounds.mean(axis=0), kind='stable'):
+            members, member_d = self.clusters[k]
+            queries = np.flatnonzero(bounds[:, k] <= best_dist + _EPS)
+            if not len(members) or not len(queries):
+                continue
+
+            # pivot bound per template: |J(q, P) - J(P, t)| <= best
+            a, best = q_counts[queries], best_dist[queries]
+            keep = np.ones(len(members), dtype=bool)
+            if k < len(self.radius):
+                q_d = proto_d[queries, k]
+                keep &= member_d >= (q_d - best).min() - _EPS
+                keep &= member_d <= (q_d + best).max() + _EPS
+
+            # count bound: 1 - min(a, b) / max(a, b) <= best
+            if (best < 1.0).all():
+                member_counts = self.templates[1][members]
+                keep &= member_counts >= (a * (1.0 - best)).min() - _EPS
+                keep &= member_counts <= (a / (1.0 - best)).max() + _EPS
+
+            members = members[keep]
+            if not len(members):
+                continue
+
+            idx, d = self._nearest(q_packed[queries], q_counts[queries],
+                                   members, 'jaccard', batch_size)
+            comparisons += len(queries) * len(members)
+
+            # ties resolve to the first template in the original order
+            better = (d < best) | ((d == best) & (idx < best_idx[queries]))
+            best_idx[queries[better]] = idx[better]
+            best_dist[queries[better]] = d[better]
+
+        self.n_comparisons += comparisons
+        self.n_pruned += n_queries * len(self.class_ids) - comparisons
+        return best_idx, best_dist
+
+    def _query_classes(self, q_packed, q_counts, dist, n_classes,
+                       batch_size):
+        """
+        Approximate search among the templates of the classes with the
+        nearest pivots.
+        :return: Indices of the nearest templates and their dissimilarities.
+        """
+        n_queries = len(q_packed)
+        proto_d = self._prototype_distances(q_packed, q_counts)
+
+        # distance of every query to the nearest pivot of every class
+        class_d = np.ones((n_queries, len(self.classes)))
+        for c in np.unique(self.prototype_classes):
+            class_d[:, c] = proto_d[:, self.prototype_classes == c].min(
+                axis=1)
+        nearest_classes = np.argsort(class_d, axis=1,
+                                     kind='stable')[:, :n_classes]
+
+        best_idx = np.full(n_queries, len(self.class_ids), dtype=np.int64)
+        best_dist = np.full(n_queries, np.inf)
+        comparisons = 0
+        for c in np.unique(nearest_classes):
+            queries = np.flatnonzero((nearest_classes == c).any(axis=1))
+            members = np.flatnonzero(self.class_ids == c)
+            idx, d = self._nearest(q_packed[queries], q_counts[queries],
+                                   members, dist, batch_size)
+            comparisons += len(queries) * len(members)
+
+            # ties resolve to the first template in the original order
+            best = best_dist[queries]
+            better = (d < best) | ((d == best) & (idx < best_idx[queries]))
+            best_idx[queries[better]] = idx[better]
+            best_dist[queries[better]] = d[better]
+
+        self.n_comparisons += comparisons
+        self.n_pruned += n_queries * len(self.class_ids) - comparisons
+        return best_idx, best_dist
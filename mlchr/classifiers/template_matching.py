@@ -1,69 +1,312 @@
 """This module contains template matching classification algorithms."""
-import copy
+import os
 import sys
-from scipy.spatial import distance
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from mlchr.classifiers import condensation, distances
+from mlchr.classifiers.template_index import TemplateIndex
+from mlchr.utils import profiling
+
+# templates memory-mapped by each worker process
+_WORKER_TEMPLATES = {}
+
+
+def _init_worker(store_dir, n_bits):
+    """
+    Memory-maps the shared template store in a worker process.
+    :param store_dir: Directory holding the template store.
+    :param n_bits: Number of pixels per image.
+    """
+    for name in ('X', 'counts'):
+        _WORKER_TEMPLATES[name] = np.load(os.path.join(
+            store_dir, name + '.npy'), mmap_mode='r')
+    _WORKER_TEMPLATES['n_bits'] = n_bits
+
+
+def _predict_chunk(x_t, counts, dist, batch_size):
+    """
+    :return: Indices of the nearest templates for a chunk of test images.
+    """
+    idx, _ = distances.nearest(x_t, counts, _WORKER_TEMPLATES['X'],
+                               _WORKER_TEMPLATES['counts'],
+                               _WORKER_TEMPLATES['n_bits'], dist,
+                               batch_size)
+    return idx
 
 
 class TemplateMatchingClassifier:
     """TemplateMatchingClassifier"""
 
-    def __init__(self):
+    def __init__(self,
+                 batch_size=64,
+                 n_jobs=1,
+                 chunk_size=1024,
+                 use_index=False,
+                 prototypes=True,
+                 exact_match=True):
         """
         Sets distance functions that can be used.
+        :param batch_size: Number of test images compared at a time.
+        :param n_jobs: Number of worker processes (-1 for all cores).
+        :param chunk_size: Number of test images sent to a worker at a time.
+        :param use_index: Build a pruned TemplateIndex in fit.
+        :param prototypes: Use per-class medoid pivots in the index.
+        :param exact_match: With Jaccard, predict the class of a stored
+        template identical to the test image without a scan. Yule queries
+        always scan, since templates whose pixels are a subset or superset
+        of the test image are also at distance 0 and may come first.
         """
-        self.distance_map = {
-            'jaccard': distance.jaccard,
-            'yule': distance.yule
-        }
+        self.distance_map = distances.DISTANCES
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.use_index = use_index
+        self.prototypes = prototypes
+        self.exact_match = exact_match
+        self.index = None
         self.X = None
         self.y = None
+        self.counts = None
+        self.n_bits = None
+        self.n_duplicates = 0
+        self.n_exact_matches = 0
+        self._packed = None
+        self._counts = None
+        self._hashes = {}
 
-    def fit(self, x, y):
+    def fit(self, x, y=None):
         """
-        :param x: A list of 2d numpy arrays that represent pixel values(0/1).
-        :param y: A list of the corresponding target classes for the images.
+        :param x: A list of 2d numpy arrays that represent pixel values(0/1),
+        a 3d numpy array or an OCRDataset.
+        :param y: A list of the corresponding target classes for the images
+        (defaults to the labels of an OCRDataset).
         """
+        with profiling.stage('TemplateMatchingClassifier.fit',
+                             items=len(x)):
+            self._reset()
+            self.partial_fit(x, y)
 
-        self.y = y
-        # flatten 2d arrays
-        self.X = copy.deepcopy(x)
-        self.X = [img.flatten() for img in self.X]
+            if self.use_index and self.X is not None:
+                self._build_index()
 
-    def predict(self, x_test, dist='yule', print_progress=False):
+    def _reset(self):
+        """
+        Removes every template.
+        """
+        self.X = None
+        self.y = None
+        self.counts = None
+        self.n_bits = None
+        self.n_duplicates = 0
+        self._packed = None
+        self._counts = None
+        self._hashes = {}
+
+    def partial_fit(self, x, y=None):
+        """
+        Appends templates. Images identical to a stored template are
+        skipped, a scan would always find the stored one first.
+        :param x: A list of 2d numpy arrays that represent pixel values(0/1),
+        a 3d numpy array or an OCRDataset.
+        :param y: A list of the corresponding target classes for the images
+        (defaults to the labels of an OCRDataset).
         """
-        :param x_test: A list of 2d numpy arrays that holds images.
+        y = x.labels if y is None else y
+        with profiling.stage('TemplateMatchingClassifier.partial_fit',
+                             items=len(x)) as stage:
+            # pack 2d arrays into uint64 words
+            packed, counts, n_bits = distances.pack_bits(x)
+            if not len(packed):
+                return
+            if self.n_bits is None:
+                self.n_bits = n_bits
+                self.y = []
+                self._packed = np.empty((0, packed.shape[1]),
+                                        dtype=np.uint64)
+                self._counts = np.empty(0, dtype=np.int64)
+            elif n_bits != self.n_bits:
+                raise ValueError('Images must have {0} pixels.'.format(
+                    self.n_bits))
+
+            # keep the first of identical templates
+            keep = []
+            for i, row in enumerate(packed):
+                key = row.tobytes()
+                if key in self._hashes:
+                    self.n_duplicates += 1
+                    continue
+                self._hashes[key] = len(self.y) + len(keep)
+                keep.append(i)
+
+            self._append(packed[keep], counts[keep])
+            self.y.extend(y[i] for i in keep)
+            self.index = None
+            stage.update(nbytes=self.X.nbytes)
+
+    def _append(self, packed, counts):
+        """
+        Copies templates into the buffers, doubling their capacity when
+        they are full.
+        """
+        n, m = len(self.y), len(packed)
+        if n + m > len(self._packed):
+            capacity = max(n + m, 2 * len(self._packed), 1024)
+            buffer = np.empty((capacity, self._packed.shape[1]),
+                              dtype=np.uint64)
+            buffer[:n] = self._packed[:n]
+            self._packed = buffer
+            buffer = np.empty(capacity, dtype=np.int64)
+            buffer[:n] = self._counts[:n]
+            self._counts = buffer
+
+        self._packed[n:n + m] = packed
+        self._counts[n:n + m] = counts
+        self.X = self._packed[:n + m]
+        self.counts = self._counts[:n + m]
+
+    def _build_index(self):
+        """
+        Builds the pruned TemplateIndex of the stored templates.
+        """
+        self.index = TemplateIndex(self.X,
+                                   self.counts,
+                                   self.n_bits,
+                                   self.y,
+                                   prototypes=self.prototypes)
+
+    def condense(self, method='cnn', dist='yule', **kwargs):
+        """
+        Keeps only the templates selected by a condensation method.
+        :param method: 'cnn' (condensed nearest neighbour) or 'medoids'
+        (per-class medoids), see the condensation module.
+        :param dist: Distance ('yule' or 'jaccard').
+        :param kwargs: Keyword arguments of the condensation method.
+        :return: Indices of the kept templates.
+        """
+        with profiling.stage('TemplateMatchingClassifier.condense',
+                             items=len(self.y),
+                             method=method) as stage:
+            keep = condensation.METHODS[method](self.X,
+                                                self.counts,
+                                                self.n_bits,
+                                                self.y,
+                                                dist=dist,
+                                                **kwargs)
+            packed, counts = self.X[keep], self.counts[keep]
+            y = [self.y[i] for i in keep]
+
+            # the copies become the (full) buffers of partial_fit
+            self._packed = self.X = packed
+            self._counts = self.counts = counts
+            self.y = y
+            self._hashes = {row.tobytes(): i for i, row in enumerate(packed)}
+
+            self.index = None
+            if self.use_index:
+                self._build_index()
+            stage.update(nbytes=self.X.nbytes)
+        return keep
+
+    def predict(self,
+                x_test,
+                dist='yule',
+                print_progress=False,
+                exact=True,
+                n_classes=3):
+        """
+        :param x_test: A list of 2d numpy arrays that holds images, a 3d
+        numpy array or an OCRDataset.
         :param dist: Distance ('yule' or 'jaccard').
         :param print_progress: Print prediction progress (False by default)
+        :param exact: Index search returns the same classes as a full scan.
+        :param n_classes: Classes searched by an inexact index search.
+        :return: A list with the predicted target classes.
+        """
+
+        if dist not in self.distance_map:
+            raise KeyError(dist)
+
+        with profiling.stage('TemplateMatchingClassifier.predict',
+                             items=len(x_test),
+                             dist=dist):
+            return self._predict(x_test, dist, print_progress, exact,
+                                 n_classes)
+
+    def _predict(self, x_test, dist, print_progress, exact, n_classes):
+        """
         :return: A list with the predicted target classes.
         """
+        # pack 2d arrays into uint64 words
+        x_t, counts, n_bits = distances.pack_bits(x_test)
+        if not len(x_t):
+            return []
+        if n_bits != self.n_bits:
+            raise ValueError('Test images must have {0} pixels.'.format(
+                self.n_bits))
+
+        # images identical to a template skip the scan
+        nearest = np.full(len(x_t), -1, dtype=np.int64)
+        if self.exact_match and dist == 'jaccard':
+            nearest[:] = [self._hashes.get(row.tobytes(), -1) for row in x_t]
+            self.n_exact_matches += int(np.count_nonzero(nearest >= 0))
+        missing = np.flatnonzero(nearest < 0)
+
+        if self.use_index and self.index is None:
+            self._build_index()
 
-        # set distance function
-        distance_function = self.distance_map[dist]
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+        chunks = [(x_t[missing[start:start + self.chunk_size]],
+                   counts[missing[start:start + self.chunk_size]])
+                  for start in range(0, len(missing), self.chunk_size)]
 
-        # flatten 2d arrays
-        x_t = copy.deepcopy(x_test)
-        x_t = [img.flatten() for img in x_t]
+        if self.index is not None:
+            results = (self.index.query(chunk, chunk_counts, dist, exact,
+                                        n_classes, self.batch_size)[0]
+                       for chunk, chunk_counts in chunks)
+        elif n_jobs > 1 and len(chunks) > 1:
+            results = self._predict_parallel(chunks, dist, n_jobs)
+        else:
+            results = (distances.nearest(chunk, chunk_counts, self.X,
+                                         self.counts, self.n_bits, dist,
+                                         self.batch_size)[0]
+                       for chunk, chunk_counts in chunks)
 
-        y = []
-        i = 0
-        for img in x_t:
-            dissimilarity = sys.maxsize
-            class_prediction = None
+        start = 0
+        for idx in results:
+            nearest[missing[start:start + len(idx)]] = idx
+            start += len(idx)
 
             if print_progress:
                 sys.stdout.write("\rTemplate Matching [{1}]:{0}%".format(
-                    int(((i + 1) / len(x_t)) * 100), dist))
+                    int(((len(x_t) - len(missing) + start) / len(x_t)) *
+                        100), dist))
                 sys.stdout.flush()
-                i += 1
 
-            for j in range(0, len(self.X)):
-                temp_dissimilarity = distance_function(img, self.X[j])
-
-                if temp_dissimilarity < dissimilarity:
-                    dissimilarity = temp_dissimilarity
-                    class_prediction = self.y[j]
+        # return predictions
+        return [self.y[j] for j in nearest]
 
-            y.append(class_prediction)
+    def _predict_parallel(self, chunks, dist, n_jobs):
+        """
+        Splits test chunks across a process pool. Workers memory-map one
+        on-disk copy of the templates instead of receiving self.X, and at
+        most 2 * n_jobs chunks are in flight at a time.
+        :return: A generator of nearest template indices per chunk.
+        """
+        with tempfile.TemporaryDirectory() as store_dir:
+            np.save(os.path.join(store_dir, 'X.npy'), self.X)
+            np.save(os.path.join(store_dir, 'counts.npy'), self.counts)
 
-        # return predictions
-        return y
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     initializer=_init_worker,
+                                     initargs=(store_dir,
+                                               self.n_bits)) as pool:
+                pending = []
+                for chunk, chunk_counts in chunks:
+                    pending.append(
+                        pool.submit(_predict_chunk, chunk, chunk_counts,
+                                    dist, self.batch_size))
+                    if len(pending) >= 2 * n_jobs:
+                        yield pending.pop(0).result()
+                for future in pending:
+                    yield future.result()
@@ -1,5 +1,12 @@
 """This module contains the base class for feature extractors."""
 import abc
+import numpy as np
+from mlchr.utils.dataset import OCRDataset
+from mlchr.utils import profiling
+from mlchr.utils.image import OCRImage, as_batch
+
+# default number of images per chunk of a streaming transform
+CHUNK_SIZE = 4096
 
 
 class BaseExtractor:
@@ -11,9 +18,244 @@ class BaseExtractor:
     def fit(self, x):
         """fit"""
 
-    @abc.abstractmethod
-    def transform(self, x):
-        """transform"""
+    def params(self):
+        """
+        :return: Parameters that determine the features, e.g. for cache
+        keys (every attribute by default).
+        """
+        return vars(self)
+
+    def transform(self, x, out=None, dtype=None, chunk_size=None):
+        """
+        :param x: A list of 2d numpy arrays that represent pixel values(0/1),
+        a 3d numpy array (N x H x W), an OCRDataset, or an iterable of
+        images or batches of images.
+        :param out: A numpy array (N x n_features), e.g. a np.memmap, the
+        features are written into.
+        :param dtype: Numpy dtype of the features (extractor's by default).
+        :param chunk_size: Number of images transformed at a time (all at
+        once by default, unless x is an iterable).
+        :return: A numpy array of features for each image.
+        """
+        if out is None and chunk_size is None and is_batch(x):
+            context = BatchContext(as_batch(x))
+            n, height, width = context.x.shape
+            x_transformed = np.empty(
+                (n, self.n_features(height, width)),
+                dtype=self.dtype() if dtype is None else dtype)
+            if not n:
+                return x_transformed
+            with profiling.stage(type(self).__name__ + '.transform',
+                                 items=n,
+                                 nbytes=x_transformed.nbytes):
+                self.transform_context(context, x_transformed)
+            return x_transformed
+
+        chunks = self.transform_iter(x, chunk_size or CHUNK_SIZE, dtype)
+        if out is None:
+            chunks = list(chunks)
+            if not chunks:
+                return np.empty((0, 0), dtype=self.dtype()
+                                if dtype is None else dtype)
+            return np.concatenate(chunks)
+
+        start = 0
+        for chunk in chunks:
+            if start + len(chunk) > len(out):
+                raise ValueError('out has room for {0} images.'.format(
+                    len(out)))
+            out[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        if start != len(out):
+            raise ValueError('out has {0} rows but {1} images were given.'
+                             .format(len(out), start))
+        return out
+
+    def transform_iter(self, x, chunk_size=None, dtype=None):
+        """
+        :param x: A list of 2d numpy arrays that represent pixel values(0/1),
+        a 3d numpy array (N x H x W), an OCRDataset, or an iterable of
+        images or batches of images.
+        :param chunk_size: Number of images transformed at a time.
+        :param dtype: Numpy dtype of the features (extractor's by default).
+        :return: A generator of feature arrays, one per chunk of images.
+        """
+        for batch in iter_batches(x, chunk_size or CHUNK_SIZE):
+            yield self.transform(batch, dtype=dtype)
+
+    def transform_to_file(self,
+                          x,
+                          filename,
+                          n_images,
+                          image_shape,
+                          dtype=None,
+                          chunk_size=None):
+        """
+        Transforms images chunk by chunk into a memory-mapped .npy file.
+        :param x: Images, see transform_iter.
+        :param filename: Output .npy filename.
+        :param n_images: Number of images in x.
+        :param image_shape: Image (height, width).
+        :param dtype: Numpy dtype of the features (extractor's by default).
+        :param chunk_size: Number of images transformed at a time.
+        :return: The memory-mapped feature array.
+        """
+        out = np.lib.format.open_memmap(
+            filename,
+            mode='w+',
+            dtype=self.dtype() if dtype is None else dtype,
+            shape=(n_images, self.n_features(*image_shape)))
+        self.transform(x, out=out, dtype=dtype, chunk_size=chunk_size)
+        out.flush()
+        return out
 
     def fit_transform(self, x):
         """fit transform"""
+        self.fit(x)
+        return self.transform(x)
+
+    def dtype(self):
+        """
+        :return: Numpy dtype of the features.
+        """
+        return np.dtype(np.int32)
+
+    @abc.abstractmethod
+    def n_features(self, height, width):
+        """
+        :param height: Image height.
+        :param width: Image width.
+        :return: Number of features per image.
+        """
+
+    @abc.abstractmethod
+    def transform_context(self, context, out):
+        """
+        :param context: A BatchContext of the images.
+        :param out: A numpy array (N x n_features) the features are
+        written into.
+        """
+
+
+class BatchContext:
+    """
+    A batch of images and intermediates computed from it once, shared by
+    every extractor that runs on the batch.
+    """
+
+    def __init__(self, x):
+        """
+        :param x: A 3d numpy array of images (N x H x W).
+        """
+        self.x = x
+        self._cache = {}
+
+    def _get(self, name, compute):
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    @property
+    def is_binary(self):
+        """
+        :return: True if every pixel value is 0 or 1.
+        """
+        return self._get(
+            'is_binary', lambda: self.x.dtype == bool or not self.x.size or
+            (self.x.min() >= 0 and self.x.max() <= 1))
+
+    @property
+    def integral(self):
+        """
+        :return: Summed-area tables of the pixel values.
+        """
+        return self._get('integral', lambda: integral_image(self.x))
+
+    @property
+    def ones_integral(self):
+        """
+        :return: Summed-area tables of the pixels equal to 1.
+        """
+        if self.is_binary:
+            return self.integral
+        return self._get('ones_integral',
+                         lambda: integral_image(self.x == 1))
+
+    @property
+    def row_sums(self):
+        """
+        :return: Pixel sums of every row (N x H).
+        """
+        return self._get('row_sums',
+                         lambda: self.x.sum(axis=2, dtype=np.int64))
+
+    @property
+    def column_sums(self):
+        """
+        :return: Pixel sums of every column (N x W).
+        """
+        return self._get('column_sums',
+                         lambda: self.x.sum(axis=1, dtype=np.int64))
+
+
+def integral_image(x):
+    """
+    :param x: A 3d numpy array of images (N x H x W).
+    :return: Summed-area tables (N x H+1 x W+1), where [n, r, c] holds the
+    sum of pixels above and to the left of (r, c) in image n.
+    """
+    n, height, width = x.shape
+    table = np.zeros((n, height + 1, width + 1), dtype=np.int32)
+    np.cumsum(x, axis=1, dtype=np.int32, out=table[:, 1:, 1:])
+    np.cumsum(table[:, 1:, 1:], axis=2, out=table[:, 1:, 1:])
+    return table
+
+
+def is_batch(x):
+    """
+    :param x: Input of a transform.
+    :return: True if x is a single batch of images rather than a stream.
+    A list or tuple is a stream when it holds batches (3d numpy arrays or
+    OCRDataset instances).
+    """
+    if isinstance(x, (np.ndarray, OCRDataset)):
+        return True
+    return isinstance(x, (list, tuple)) and not any(
+        isinstance(item, OCRDataset) or (isinstance(item, np.ndarray)
+                                         and item.ndim == 3) for item in x)
+
+
+def is_image(x):
+    """
+    :param x: An item of a stream of images.
+    :return: True if x is a single image rather than a batch.
+    """
+    return isinstance(x, OCRImage) or (isinstance(x, np.ndarray)
+                                       and x.ndim == 2)
+
+
+def iter_batches(x, chunk_size):
+    """
+    :param x: A batch of images, or an iterable of images or batches.
+    :param chunk_size: Maximum number of images per batch.
+    :return: A generator of 3d numpy arrays (n x H x W), n <= chunk_size.
+    """
+    if is_batch(x):
+        for start in range(0, len(x), chunk_size):
+            yield as_batch(x[start:start + chunk_size])
+        return
+
+    images = []
+    for item in x:
+        if is_image(item):
+            images.append(item)
+            if len(images) == chunk_size:
+                yield as_batch(images)
+                images = []
+            continue
+        if images:
+            yield as_batch(images)
+            images = []
+        yield from iter_batches(item, chunk_size)
+    if images:
+        yield as_batch(images)
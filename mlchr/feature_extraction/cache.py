@@ -0,0 +1,226 @@
+"""
+This module contains a content-addressed on-disk cache for extracted
+features. Entries are keyed by a hash of the pixel data plus the extractor
+class and parameters, stored as .npy files and loaded memory-mapped.
+"""
+import hashlib
+import os
+import tempfile
+import numpy as np
+from mlchr.feature_extraction.base import BaseExtractor, is_batch
+from mlchr.utils import profiling
+from mlchr.utils.image import as_batch
+
+
+def describe(value):
+    """
+    :param value: An extractor or one of its parameters.
+    :return: A description of the value that does not depend on object
+    addresses: extractors become their class name and (recursively
+    described) params, a CachedExtractor the extractor it wraps, other
+    objects their class name and attributes, and numpy arrays their dtype,
+    shape and a digest of the data.
+    """
+    if isinstance(value, CachedExtractor):
+        return describe(value.extractor)
+    if isinstance(value, BaseExtractor):
+        return ('{0}.{1}'.format(type(value).__module__,
+                                 type(value).__name__),
+                describe(value.params()))
+    if isinstance(value, (list, tuple)):
+        return [describe(item) for item in value]
+    if isinstance(value, dict):
+        return sorted((repr(k), describe(v)) for k, v in value.items())
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        return ('ndarray', value.dtype.str, value.shape,
+                hashlib.blake2b(value.data, digest_size=20).hexdigest())
+    if hasattr(value, '__dict__') and not isinstance(value, type):
+        return ('{0}.{1}'.format(type(value).__module__,
+                                 type(value).__name__),
+                describe(vars(value)))
+    return repr(value)
+
+
+class FeatureCache:
+    """FeatureCache"""
+
+    def __init__(self, directory, max_bytes=2**30):
+        """
+        :param directory: Cache directory.
+        :param max_bytes: Size limit, least recently used entries are
+        evicted beyond it.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(extractor, x):
+        """
+        :param extractor: A BaseExtractor instance.
+        :param x: A 3d numpy array (N x H x W).
+        :return: Hex digest of the pixels, extractor class and parameters
+        (see describe).
+        """
+        x = np.ascontiguousarray(x)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr(describe(extractor)).encode())
+        digest.update('{0}{1}'.format(x.dtype.str, x.shape).encode())
+        digest.update(x.data)
+        return digest.hexdigest()
+
+    def path(self, key):
+        """
+        :param key: Entry key.
+        :return: Path of the entry file.
+        """
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        """
+        :param key: Entry key.
+        :return: A read-only memory-mapped feature matrix, None on a miss.
+        """
+        path = self.path(key)
+        try:
+            features = np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        # mark as recently used
+        os.utime(path)
+        self.hits += 1
+        return features
+
+    def put(self, key, features):
+        """
+        :param key: Entry key.
+        :param features: Feature matrix.
+        """
+        # write to a temporary file first so readers never see partial data
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            np.save(fp, features)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def entries(self):
+        """
+        :return: A list of (path, size, last use) tuples, oldest first.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((os.path.join(self.directory, name),
+                                stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in
+        max_bytes.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+    def stats(self):
+        """
+        :return: Hit/miss statistics and cache size.
+        """
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries)
+        }
+
+
+class CachedExtractor(BaseExtractor):
+    """Feature extractor wrapper that caches transform results."""
+
+    def __init__(self, extractor, cache):
+        """
+        :param extractor: A BaseExtractor instance.
+        :param cache: A FeatureCache instance.
+        """
+        super().__init__()
+        self.extractor = extractor
+        self.cache = cache
+
+    def fit(self, x):
+        """fit"""
+        self.extractor.fit(x)
+
+    def dtype(self):
+        """
+        :return: Numpy dtype of the features.
+        """
+        return self.extractor.dtype()
+
+    def n_features(self, height, width):
+        """
+        :return: Number of features per image.
+        """
+        return self.extractor.n_features(height, width)
+
+    def transform_context(self, context, out):
+        """
+        :param context: A BatchContext of the images.
+        :param out: A numpy array (N x n_features) of features for each
+        image.
+        """
+        key = self.cache.key(self.extractor, context.x)
+        x_transformed = self.cache.get(key)
+        if x_transformed is None:
+            self.extractor.transform_context(context, out)
+            self.cache.put(key, out.astype(self.dtype()))
+        else:
+            out[:] = x_transformed
+
+    def transform(self, x, out=None, dtype=None, chunk_size=None):
+        """
+        :param x: A list of 2d numpy arrays that represent pixel values(0/1),
+        a 3d numpy array (N x H x W) or an OCRDataset. Streams and chunked
+        transforms are cached chunk by chunk.
+        :return: A numpy array of features for each image, memory-mapped
+        and read-only if it was found in the cache.
+        """
+        if out is not None or chunk_size is not None or not is_batch(x):
+            return super().transform(x, out, dtype, chunk_size)
+
+        x = as_batch(x)
+        with profiling.stage('CachedExtractor.transform',
+                             items=len(x)) as stage:
+            key = self.cache.key(self.extractor, x)
+            x_transformed = self.cache.get(key)
+            stage.update(hit=x_transformed is not None)
+            if x_transformed is None:
+                x_transformed = self.extractor.transform(x)
+                self.cache.put(key, x_transformed)
+            if dtype is not None:
+                x_transformed = x_transformed.astype(dtype)
+            stage.update(nbytes=x_transformed.nbytes)
+        return x_transformed
@@ -13,30 +13,32 @@ class ProjectionsExtractor(BaseExtractor):
         super().__init__()
         self.projections = projections
 
-    def transform(self, x):
+    def n_features(self, height, width):
         """
-        :param x: A list of 2d numpy arrays that represent pixel values(0/1).
-        :return: A numpy array of projections for each image.
+        :return: Number of projections per image.
         """
+        return 2 * self.projections
 
-        x_transformed = []
-
-        # for each image
-        for image in x:
-            img_features = []
-            # for each projection
-            for k in range(1, self.projections + 1):
-                horizontal_pixels = 0
-                vertical_pixels = 0
-                height = image.shape[0]
-                width = image.shape[1]
-                for i in range(0, int(k * height / self.projections)):
-                    for y in range(0, width):
-                        horizontal_pixels += image[i, y]
-                        vertical_pixels += image[y, i]
-                img_features.append(horizontal_pixels)
-                img_features.append(vertical_pixels)
-
-            x_transformed.append(img_features)
-
-        return np.array(x_transformed)
+    def transform_context(self, context, out):
+        """
+        :param context: A BatchContext of the images.
+        :param out: A numpy array (N x n_features) of projections for each
+        image, alternating horizontal (top rows) and vertical (left columns)
+        pixel counts.
+        """
+
+        n, height, width = context.x.shape
+
+        # cumulative row and column totals, prefixed with 0
+        rows = np.zeros((n, height + 1), dtype=np.int64)
+        np.cumsum(context.row_sums, axis=1, out=rows[:, 1:])
+        columns = np.zeros((n, width + 1), dtype=np.int64)
+        np.cumsum(context.column_sums, axis=1, out=columns[:, 1:])
+
+        # projection cut-points
+        ks = range(1, self.projections + 1)
+        row_cuts = [int(k * height / self.projections) for k in ks]
+        column_cuts = [int(k * width / self.projections) for k in ks]
+
+        out[:, 0::2] = rows[:, row_cuts]
+        out[:, 1::2] = columns[:, column_cuts]
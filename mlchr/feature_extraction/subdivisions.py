@@ -5,18 +5,26 @@ For more details visit: http://users.iit.demokritos.gr/~bgat/PRHandRec2010.pdf
 
 from mlchr.feature_extraction.base import BaseExtractor
 import numpy as np
-import sys
 
 
 class SubdivisionsExtractor(BaseExtractor):
     """SubdivisionsExtractor"""
 
-    def __init__(self, granularity):
+    def __init__(self, granularity, batch_size=256):
         """
         :param granularity: Divisions granularity.
+        :param batch_size: Number of images divided at a time.
         """
         super().__init__()
         self.granularity = granularity
+        self.batch_size = batch_size
+
+    def params(self):
+        """
+        :return: Parameters that determine the features (batch_size only
+        changes how they are computed).
+        """
+        return {'granularity': self.granularity}
 
     @staticmethod
     def find_index(v):
@@ -24,49 +32,24 @@ class SubdivisionsExtractor(BaseExtractor):
         :param v: A python list.
         :return: Min index.
         """
-        # get vector size
-        vsize = len(v)
+        v = np.asarray(v, dtype=np.int64)
+        if len(v) < 3:
+            return -1
 
-        # prefix sum
-        prefix_sum = [None for _ in range(0, vsize)]
-        prefix_sum[0] = v[0]
-        for i in range(1, vsize):
-            prefix_sum[i] = prefix_sum[i - 1] + v[i]
-
-        # suffix sum
-        suffix_sum = [None for _ in range(0, vsize)]
-        suffix_sum[vsize - 1] = v[vsize - 1]
-        for i in range(vsize - 2, -1, -1):
-            suffix_sum[i] = suffix_sum[i + 1] + v[i]
+        # |prefix sum - suffix sum| for every index
+        prefix_sum = np.cumsum(v)
+        suffix_sum = prefix_sum[-1] - prefix_sum + v
 
         # find min index
-        min_index = -1
-        minv = sys.maxsize
-        for i in range(1, vsize - 1):
-            x = abs(prefix_sum[i] - suffix_sum[i])
-            if x < minv:
-                minv = x
-                min_index = i
-
-        return min_index
+        return int(np.abs(prefix_sum - suffix_sum)[1:-1].argmin()) + 1
 
     def find_vertical_point(self, image):
         """
         :param image: 2d numpy array.
         :return: Vertical point of division.
         """
-        height = image.shape[0]
-        width = image.shape[1]
-
-        v0 = [0 for _ in range(0, width)]
-        for y in range(0, width):
-            for x in range(0, height):
-                if image[x, y] == 1:
-                    v0[y] += 1  # vertical pixels
-
-        v1 = [
-            0 if (x % 2 == 0) else v0[int(x / 2)] for x in range(0, width * 2)
-        ]
+        v1 = np.zeros(image.shape[1] * 2, dtype=np.int64)
+        v1[1::2] = (image == 1).sum(axis=0)  # vertical pixels
 
         # find index that minimizes sum difference
         xq = self.find_index(v1)
@@ -77,20 +60,8 @@ class SubdivisionsExtractor(BaseExtractor):
         :param image: 2d numpy array.
         :return: Horizontal point of division.
         """
-
-        height = image.shape[0]
-        width = image.shape[1]
-
-        v0 = [0 for _ in range(0, height)]
-        for x in range(0, height):
-            for y in range(0, width):
-                if image[x, y] == 1:
-                    v0[x] += 1  # horizontal pixels
-
-        v1 = [
-            0 if (x % 2 == 0) else v0[int(x / 2)]
-            for x in range(0, height * 2)
-        ]
+        v1 = np.zeros(image.shape[0] * 2, dtype=np.int64)
+        v1[1::2] = (image == 1).sum(axis=1)  # horizontal pixels
 
         # find index that minimizes sum difference
         yq = self.find_index(v1)
@@ -109,9 +80,7 @@ class SubdivisionsExtractor(BaseExtractor):
         # image can't be divided any further,
         # just fill remaining features with (0,0)
         if height < 3 or width < 3:
-            for _ in range(0, 4**granularity):
-                img_features.append(0)
-                img_features.append(0)
+            img_features.extend([0, 0] * 4**granularity)
             return
 
         xq = self.find_vertical_point(image)
@@ -120,59 +89,152 @@ class SubdivisionsExtractor(BaseExtractor):
         yq = self.find_horizontal_point(image)
         y0 = int(yq / 2)
 
-        # left up sub-image
-        rows = [x for x in range(0, y0)]
-        columns = [x for x in range(0, x0)]
-        left_up_image = image[np.ix_(rows, columns)]
-
-        # right up sub-image
-        rows = [x for x in range(0, y0)]
-        if xq % 2 == 0:
-            columns = [x for x in range(x0 - 1, width)]
-        else:
-            columns = [x for x in range(x0, width)]
-        right_up_image = image[np.ix_(rows, columns)]
-
-        # left down sub-image
-        if yq % 2 == 0:
-            rows = [x for x in range(y0 - 1, height)]
-        else:
-            rows = [x for x in range(y0, height)]
-        columns = [x for x in range(0, x0)]
-        left_down_image = image[np.ix_(rows, columns)]
-
-        # right down sub-image
-        if yq % 2 == 0:
-            rows = [x for x in range(y0 - 1, height)]
-        else:
-            rows = [x for x in range(y0, height)]
-        if xq % 2 == 0:
-            columns = [x for x in range(x0 - 1, width)]
-        else:
-            columns = [x for x in range(x0, width)]
-        right_down_image = image[np.ix_(rows, columns)]
-
-        if granularity > 0:
-            self.rec_sub_div(left_up_image, granularity - 1, img_features)
-            self.rec_sub_div(right_up_image, granularity - 1, img_features)
-            self.rec_sub_div(left_down_image, granularity - 1, img_features)
-            self.rec_sub_div(right_down_image, granularity - 1, img_features)
-        else:
+        if granularity == 0:
             img_features.append(x0)
             img_features.append(y0)
+            return
 
-    def transform(self, x):
+        # sub-images are views, neighbours share the middle row/column
+        # when the division point falls on a pixel
+        right_from = x0 - 1 if xq % 2 == 0 else x0
+        down_from = y0 - 1 if yq % 2 == 0 else y0
+        self.rec_sub_div(image[:y0, :x0], granularity - 1, img_features)
+        self.rec_sub_div(image[:y0, right_from:], granularity - 1,
+                         img_features)
+        self.rec_sub_div(image[down_from:, :x0], granularity - 1,
+                         img_features)
+        self.rec_sub_div(image[down_from:, right_from:], granularity - 1,
+                         img_features)
+
+    @staticmethod
+    def division_points(table, img, start, stop, other_start, other_stop,
+                        axis):
+        """
+        Batched find_vertical_point/find_horizontal_point over sub-images
+        given as offset ranges into summed-area tables.
+        :param table: Summed-area tables (N x H+1 x W+1) of the images.
+        :param img: Image index of every sub-image.
+        :param start: First row (axis=0) or column (axis=1) of every
+        sub-image.
+        :param stop: End row/column of every sub-image.
+        :param other_start: First column/row of every sub-image.
+        :param other_stop: End column/row of every sub-image.
+        :param axis: 1 for vertical points, 0 for horizontal points.
+        :return: Points of division.
         """
-        :param x: A list of 2d numpy arrays that represent pixel values(0/1).
+        size = stop - start
+        steps = np.arange(0, max(size.max(initial=0), 1))
+        valid = steps[np.newaxis, :] < size[:, np.newaxis]
+
+        # offsets into the flattened tables along both axes
+        _, n_rows, n_columns = table.shape
+        stride = 1 if axis == 1 else n_columns
+        other_stride = n_columns if axis == 1 else 1
+        base = img * (n_rows * n_columns)
+        lo = base + other_start * other_stride
+        hi = base + other_stop * other_stride
+        flat = table.reshape(-1)
+
+        # profile prefix sums: pixels of the sub-image before start + m + 1
+        ends = np.minimum(start[:, np.newaxis] + steps + 1,
+                          table.shape[axis + 1] - 1) * stride
+        cum = (flat[hi[:, np.newaxis] + ends] -
+               flat[lo[:, np.newaxis] + ends] -
+               (flat[hi + start * stride] -
+                flat[lo + start * stride])[:, np.newaxis])
+        cum = np.where(valid, cum, 0).astype(np.int64)
+        total = cum[np.arange(len(cum)), np.maximum(size - 1, 0)]
+        previous = np.zeros_like(cum)
+        previous[:, 1:] = cum[:, :-1]
+
+        # |prefix sum - suffix sum| of the interleaved (0, v) profile
+        diff = np.empty((len(cum), 2 * cum.shape[1]), dtype=np.int64)
+        diff[:, 0::2] = np.abs(2 * previous - total[:, np.newaxis])
+        diff[:, 1::2] = np.abs(cum + previous - total[:, np.newaxis])
+        index = np.arange(0, diff.shape[1])
+        outside = (index == 0) | (index[np.newaxis, :] >
+                                  2 * size[:, np.newaxis] - 2)
+        diff[outside] = np.iinfo(np.int64).max
+
+        return diff.argmin(axis=1) + 1
+
+    def transform_batch(self, table):
+        """
+        Divides a batch of images breadth-first: every granularity level
+        is processed for all sub-images of all images at once.
+        :param table: Summed-area tables (N x H+1 x W+1) of the pixels
+        equal to 1.
         :return: A numpy array of subdivision points for each image.
         """
+        n, height, width = table.shape
+        height -= 1
+        width -= 1
+
+        # sub-images as (first, end) row and column ranges, the children
+        # of sub-image k are at 4k..4k+3 so the order matches rec_sub_div
+        img = np.arange(n)
+        rows = (np.zeros(n, dtype=np.int64), np.full(n, height))
+        columns = (np.zeros(n, dtype=np.int64), np.full(n, width))
+        alive = np.ones(n, dtype=bool)
+
+        for level in range(0, self.granularity + 1):
+            alive &= ((rows[1] - rows[0] >= 3) &
+                      (columns[1] - columns[0] >= 3))
+            xq = np.full(len(img), 2)
+            yq = np.full(len(img), 2)
+            xq[alive] = self.division_points(table, img[alive],
+                                             columns[0][alive],
+                                             columns[1][alive],
+                                             rows[0][alive], rows[1][alive],
+                                             axis=1)
+            yq[alive] = self.division_points(table, img[alive],
+                                             rows[0][alive], rows[1][alive],
+                                             columns[0][alive],
+                                             columns[1][alive],
+                                             axis=0)
+            x0 = xq // 2
+            y0 = yq // 2
+            if level == self.granularity:
+                break
+
+            # left up, right up, left down and right down ranges
+            up = (rows[0], rows[0] + y0)
+            down = (rows[0] + np.where(yq % 2 == 0, y0 - 1, y0), rows[1])
+            left = (columns[0], columns[0] + x0)
+            right = (columns[0] + np.where(xq % 2 == 0, x0 - 1, x0),
+                     columns[1])
+
+            # sub-images that can't be divided keep their range
+            rows = tuple(
+                np.stack([np.where(alive, r[k], rows[k])
+                          for r in (up, up, down, down)],
+                         axis=1).ravel() for k in (0, 1))
+            columns = tuple(
+                np.stack([np.where(alive, c[k], columns[k])
+                          for c in (left, right, left, right)],
+                         axis=1).ravel() for k in (0, 1))
+            img = np.repeat(img, 4)
+            alive = np.repeat(alive, 4)
+
+        x_transformed = np.zeros((len(img), 2), dtype=np.int32)
+        x_transformed[alive, 0] = x0[alive]
+        x_transformed[alive, 1] = y0[alive]
+        return x_transformed.reshape(n, -1)
+
+    def n_features(self, height, width):
+        """
+        :return: Number of subdivision points (x, y) per image.
+        """
+        return 2 * 4**self.granularity
 
-        x_transformed = []
-
-        # for each image
-        for image in x:
-            img_features = []
-            self.rec_sub_div(image, self.granularity, img_features)
-            x_transformed.append(img_features)
+    def transform_context(self, context, out):
+        """
+        :param context: A BatchContext of the images.
+        :param out: A numpy array (N x n_features) of subdivision points
+        for each image.
+        """
 
-        return np.array(x_transformed)
+        table = context.ones_integral
+        for start in range(0, len(table), self.batch_size):
+            stop = start + self.batch_size
+            out[start:stop] = self.transform_batch(table[start:stop])
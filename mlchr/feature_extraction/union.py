@@ -0,0 +1,56 @@
+"""This module contains a combinator that runs several extractors at once."""
+from mlchr.feature_extraction.base import BaseExtractor
+from mlchr.utils import profiling
+import numpy as np
+
+
+class FeatureUnion(BaseExtractor):
+    """
+    Runs several extractors in one pass over a batch. Intermediates such as
+    the summed-area tables and row/column sums are computed once in a
+    shared BatchContext, and the features of every extractor are written
+    side by side into one preallocated matrix.
+    """
+
+    def __init__(self, extractors):
+        """
+        :param extractors: A list of BaseExtractor instances.
+        """
+        super().__init__()
+        self.extractors = extractors
+
+    def fit(self, x):
+        """fit"""
+        for extractor in self.extractors:
+            extractor.fit(x)
+
+    def dtype(self):
+        """
+        :return: Numpy dtype able to hold the features of every extractor.
+        """
+        return np.result_type(
+            *[extractor.dtype() for extractor in self.extractors])
+
+    def n_features(self, height, width):
+        """
+        :return: Total number of features per image.
+        """
+        return sum(
+            extractor.n_features(height, width)
+            for extractor in self.extractors)
+
+    def transform_context(self, context, out):
+        """
+        :param context: A BatchContext of the images.
+        :param out: A numpy array (N x n_features) of concatenated features
+        for each image.
+        """
+        n, height, width = context.x.shape
+        start = 0
+        for extractor in self.extractors:
+            stop = start + extractor.n_features(height, width)
+            with profiling.stage(type(extractor).__name__ + '.transform',
+                                 items=n,
+                                 nbytes=out[:, start:stop].nbytes):
+                extractor.transform_context(context, out[:, start:stop])
+            start = stop
@@ -17,36 +17,46 @@ class ZonesExtractor(BaseExtractor):
         self.is_weighted = is_weighted
         self.weight = weight
 
-    def transform(self, x):
+    def dtype(self):
         """
-        :param x: A list of 2d numpy arrays that represent pixel values(0/1).
-        :return: A numpy array of zones for each image.
+        :return: int32, or float32 for weighted zones.
         """
+        return np.dtype(np.float32 if self.is_weighted else np.int32)
 
-        x_transformed = []
+    def n_features(self, height, width):
+        """
+        :return: Number of zones per image.
+        """
+        return int(height / self.zones) * int(width / self.zones)
 
-        # for each image
-        for image in x:
-            img_features = []
-            height = image.shape[0]
-            width = image.shape[1]
-            # offsets external loops
-            for i in range(0, int(height / self.zones)):
-                for j in range(0, int(width / self.zones)):
-                    # calculate pixel density in zone
-                    pixels = 0
-                    for xi in range(i * self.zones, (i + 1) * self.zones):
-                        for yj in range(j * self.zones, (j + 1) * self.zones):
-                            pixels += image[xi, yj]
-                            if self.is_weighted:
-                                if xi < int(height / self.zones / 4):
-                                    if image[xi, yj] == 1:
-                                        pixels += self.weight
-                    img_features.append(pixels)
+    def transform_context(self, context, out):
+        """
+        :param context: A BatchContext of the images.
+        :param out: A numpy array (N x n_features) of zones for each image.
+        """
 
-            x_transformed.append(img_features)
+        x = context.x
+        n, height, width = x.shape
+        rows = int(height / self.zones)
+        columns = int(width / self.zones)
 
-        return np.array(x_transformed)
+        # zone sums from the summed-area table at the zone corners
+        corners = context.integral[:, 0:rows * self.zones + 1:self.zones,
+                                   0:columns * self.zones + 1:self.zones]
+        x_transformed = (corners[:, 1:, 1:] - corners[:, :-1, 1:] -
+                         corners[:, 1:, :-1] + corners[:, :-1, :-1])
+
+        if self.is_weighted:
+            # count pixels equal to 1 in the weighted top rows of every zone
+            top = min(int(height / self.zones / 4), rows * self.zones)
+            top_pixels = (x[:, :top, :columns * self.zones] == 1).reshape(
+                n, top, columns, self.zones).sum(axis=3)
+            weighted = np.zeros((n, rows, columns), dtype=np.int64)
+            for xi in range(0, top):
+                weighted[:, xi // self.zones] += top_pixels[:, xi]
+            x_transformed = x_transformed + self.weight * weighted
+
+        out[:] = x_transformed.reshape(n, -1)
 
 
 class AdaptiveZonesExtractor(BaseExtractor):
@@ -63,44 +73,52 @@ class AdaptiveZonesExtractor(BaseExtractor):
         self.zones = zones
         self.adj_range = adj_range
 
-    def transform(self, x):
-        """
-        :param x: A list of 2d numpy arrays that represent pixel values(0/1).
-        :return: A numpy array of zones for each image.
-        """
-
-        x_transformed = []
-
-        # for each image
-        for image in x:
-            img_features = []
-            height = image.shape[0]
-            width = image.shape[1]
-            # offsets external loops
-            for i in range(0, int(height / self.zones)):
-                for y in range(0, int(width / self.zones)):
-                    # calculate pixel density in zone
-                    zones_pixels = []
-                    for xo in range(-self.adj_range, self.adj_range + 1):
-                        for yo in range(-self.adj_range, self.adj_range + 1):
-                            pixels = 0
-                            from_xi = (i * self.zones) + xo
-                            to_xi = ((i + 1) * self.zones) + xo
-                            from_yi = (y * self.zones) + yo
-                            to_yi = ((y + 1) * self.zones) + yo
-                            if from_xi < 0 or to_xi > height - 1:
-                                from_xi -= xo
-                                to_xi -= xo
-                            if from_yi < 0 or to_yi > width - 1:
-                                from_yi -= yo
-                                to_yi -= yo
-                            for xi in range(from_xi, to_xi):
-                                for yi in range(from_yi, to_yi):
-                                    pixels += image[xi, yi]
-                            zones_pixels.append(pixels)
-
-                    img_features.append(max(zones_pixels))
-
-            x_transformed.append(img_features)
-
-        return np.array(x_transformed)
+    def n_features(self, height, width):
+        """
+        :return: Number of zones per image.
+        """
+        return int(height / self.zones) * int(width / self.zones)
+
+    def transform_context(self, context, out):
+        """
+        :param context: A BatchContext of the images.
+        :param out: A numpy array (N x n_features) of zones for each image.
+        """
+
+        n, height, width = context.x.shape
+        table = context.integral
+
+        # zone windows for every shift, out-of-range shifts fall back to
+        # the unshifted window
+        row_windows = self.shifted_windows(height)
+        column_windows = self.shifted_windows(width)
+
+        x_transformed = None
+        for r0, r1 in row_windows:
+            r0 = r0[:, np.newaxis]
+            r1 = r1[:, np.newaxis]
+            for c0, c1 in column_windows:
+                pixels = (table[:, r1, c1] - table[:, r0, c1] -
+                          table[:, r1, c0] + table[:, r0, c0])
+                if x_transformed is None:
+                    x_transformed = pixels
+                else:
+                    np.maximum(x_transformed, pixels, out=x_transformed)
+
+        out[:] = x_transformed.reshape(n, -1)
+
+    def shifted_windows(self, size):
+        """
+        :param size: Image height or width.
+        :return: A list of (start, stop) zone index arrays for every shift.
+        """
+        start = np.arange(0, int(size / self.zones)) * self.zones
+        windows = []
+        for offset in range(-self.adj_range, self.adj_range + 1):
+            from_i = start + offset
+            to_i = start + self.zones + offset
+            out_of_range = (from_i < 0) | (to_i > size - 1)
+            windows.append((np.where(out_of_range, start, from_i),
+                            np.where(out_of_range, start + self.zones,
+                                     to_i)))
+        return windows
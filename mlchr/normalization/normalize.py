@@ -1,5 +1,9 @@
 """This module contains the normalizer class."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from PIL import Image
+from mlchr.utils import profiling
 
 
 class Normalizer:
@@ -19,7 +23,56 @@ class Normalizer:
         https://pillow.readthedocs.io/en/stable/handbook/concepts.html#concept-filters
         """
         # normalize images
-        for img in images:
-            img.pil_image = img.pil_image.resize((self.size, self.size),
+        with profiling.stage('Normalizer.pillow_resize', items=len(images)):
+            for img in images:
+                img.pil_image = img.pil_image.resize((self.size, self.size),
+                                                     img_filter)
+                img.create_matrix()
+
+    def pillow_resize_batch(self,
+                            images,
+                            img_filter=Image.NEAREST,
+                            out=None,
+                            n_workers=None,
+                            drop_pil=False):
+        """
+        Resizes images on a thread pool and writes the binary pixels (0/1)
+        into one array. The matrix of every image becomes a view into it.
+        :param images: List of OCRImage images.
+        :param img_filter: Resampling filter to apply during normalization.
+        :param out: Preallocated uint8 array (N x size x size).
+        :param n_workers: Number of worker threads.
+        :param drop_pil: Release the Pillow images after conversion.
+        :return: A 3d numpy array (N x size x size) of pixel values.
+        """
+        shape = (len(images), self.size, self.size)
+        if out is None:
+            out = np.empty(shape, dtype=np.uint8)
+        elif out.shape != shape:
+            raise ValueError('out must have shape {0}.'.format(shape))
+
+        def resize(start, stop):
+            for i in range(start, stop):
+                img = images[i]
+                pil_image = img.pil_image.resize((self.size, self.size),
                                                  img_filter)
-            img.create_matrix()
+                out[i] = np.logical_not(pil_image)
+                img.pil_image = pil_image
+                img.matrix = out[i]
+                if drop_pil:
+                    img.release_pil()
+
+        n_workers = n_workers or os.cpu_count()
+        step = max(-(-len(images) // n_workers), 1)
+        with profiling.stage('Normalizer.pillow_resize_batch',
+                             items=len(images),
+                             nbytes=out.nbytes):
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                for future in [
+                        pool.submit(resize, start,
+                                    min(start + step, len(images)))
+                        for start in range(0, len(images), step)
+                ]:
+                    future.result()
+
+        return out
@@ -0,0 +1,160 @@
+"""This module contains an array-backed dataset of binary images."""
+import numpy as np
+
+
+class OCRDataset:
+    """OCRDataset"""
+
+    def __init__(self,
+                 pixels,
+                 ids=None,
+                 labels=None,
+                 hexes=None,
+                 packed=False,
+                 width=None):
+        """
+        :param pixels: A 3d numpy array (N x H x W) with pixel values (0/1),
+        or rows bit-packed with np.packbits(axis=2) if packed=True.
+        :param ids: Image ids (defaults to 0..N-1).
+        :param labels: Image classes.
+        :param hexes: Image hex codes.
+        :param packed: Indicate that pixels are bit-packed.
+        :param width: Image width (required if packed=True).
+        """
+        if pixels.ndim != 3:
+            raise ValueError('Expected an (N, H, W) array of images.')
+        if packed and width is None:
+            raise ValueError('Packed pixels require the image width.')
+
+        self.data = pixels
+        self.packed = packed
+        self.width = width if packed else pixels.shape[2]
+        self.height = pixels.shape[1]
+        self.ids = np.arange(len(pixels)) if ids is None else np.asarray(ids)
+        self.labels = None if labels is None else np.asarray(labels)
+        self.hexes = None if hexes is None else np.asarray(hexes)
+
+    @classmethod
+    def from_images(cls, images, packed=False):
+        """
+        :param images: A list of OCRImage images of the same size.
+        :param packed: Store pixels bit-packed.
+        :return: An OCRDataset.
+        """
+        shape = images[0].matrix.shape if images else (0, 0)
+
+        pixels = np.empty((len(images), ) + shape, dtype=np.uint8)
+        for i, img in enumerate(images):
+            pixels[i] = img.matrix
+
+        dataset = cls(pixels, [img.img_id for img in images],
+                      [img.img_class for img in images],
+                      [img.img_hex for img in images])
+        return dataset.pack() if packed else dataset
+
+    @classmethod
+    def concatenate(cls, datasets):
+        """
+        :param datasets: A list of OCRDataset instances.
+        :return: An OCRDataset with the images of all datasets.
+        """
+
+        def join(name):
+            arrays = [getattr(dataset, name) for dataset in datasets]
+            return None if any(a is None for a in arrays) else np.concatenate(
+                arrays)
+
+        first = datasets[0]
+        return cls(np.concatenate([dataset.data for dataset in datasets]),
+                   join('ids'),
+                   join('labels'),
+                   join('hexes'),
+                   packed=first.packed,
+                   width=first.width)
+
+    @property
+    def pixels(self):
+        """
+        :return: A 3d numpy array (N x H x W) of pixel values.
+        """
+        if not self.packed:
+            return self.data
+        return np.unpackbits(self.data, axis=2, count=self.width)
+
+    @property
+    def nbytes(self):
+        """
+        :return: Bytes used by the pixels and the parallel arrays.
+        """
+        arrays = (self.data, self.ids, self.labels, self.hexes)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def pack(self):
+        """
+        :return: An OCRDataset with bit-packed pixels.
+        """
+        if self.packed:
+            return self
+        return OCRDataset(np.packbits(self.data != 0, axis=2), self.ids,
+                          self.labels, self.hexes, True, self.width)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        """
+        :param key: An index, a slice or an index array.
+        :return: A 2d numpy array for an index, otherwise an OCRDataset.
+        Slices share memory with this dataset.
+        """
+        if isinstance(key, (int, np.integer)):
+            if not self.packed:
+                return self.data[key]
+            return np.unpackbits(self.data[key], axis=1, count=self.width)
+
+        def take(a):
+            return None if a is None else a[key]
+
+        return OCRDataset(self.data[key], self.ids[key], take(self.labels),
+                          take(self.hexes), self.packed, self.width)
+
+    def train_test_split(self, test_size=0.2, random_state=None):
+        """
+        Splits the dataset keeping the class proportions of the labels.
+        :param test_size: Fraction of images of each class in the test set.
+        :param random_state: Seed of the random shuffling.
+        :return: Train and test OCRDataset.
+        """
+        train, test = stratified_split(len(self), self.labels, test_size,
+                                       random_state)
+        return self[train], self[test]
+
+
+def stratified_split(n, labels=None, test_size=0.2, random_state=None):
+    """
+    :param n: Number of images.
+    :param labels: Image classes (None for a plain random split).
+    :param test_size: Fraction of images of each class in the test set.
+    :param random_state: Seed of the random shuffling.
+    :return: Sorted train and test indices.
+    """
+    rng = np.random.RandomState(random_state)
+    if labels is None:
+        groups = [np.arange(n)]
+    else:
+        _, class_ids = np.unique(labels, return_inverse=True)
+        groups = [
+            np.flatnonzero(class_ids.ravel() == c)
+            for c in range(class_ids.max(initial=-1) + 1)
+        ]
+
+    train, test = [], []
+    for group in groups:
+        group = rng.permutation(group)
+        n_test = int(round(test_size * len(group)))
+        test.append(group[:n_test])
+        train.append(group[n_test:])
+
+    train = np.sort(np.concatenate(train)).astype(np.int64)
+    test = np.sort(np.concatenate(test)).astype(np.int64)
+    return train, test
@@ -0,0 +1,188 @@
+"""
+This module contains a k-fold cross validation engine. Features are
+extracted once for the whole dataset and stored in a .npy file, and the
+folds run on worker processes that memory-map it.
+"""
+import copy
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from mlchr.utils import profiling
+from mlchr.utils.metrics import ConfusionMatrix
+from mlchr.utils.image import as_batch
+
+# features and target classes memory-mapped by each worker process
+_WORKER_DATA = {}
+
+
+def stratified_folds(y, folds=5, random_state=None):
+    """
+    Splits images into folds keeping the class proportions of y.
+    :param y: Target classes.
+    :param folds: Number of folds.
+    :param random_state: Seed of the random shuffling.
+    :return: A list of (train indices, test indices) tuples, one per fold.
+    """
+    rng = np.random.RandomState(random_state)
+    _, class_ids = np.unique(np.asarray(y), return_inverse=True)
+    class_ids = class_ids.ravel()
+
+    fold_of = np.empty(len(class_ids), dtype=np.int64)
+    offset = 0
+    for c in range(class_ids.max(initial=-1) + 1):
+        group = rng.permutation(np.flatnonzero(class_ids == c))
+        # deal the images of every class round-robin, continuing where the
+        # previous class stopped so fold sizes differ by at most one
+        fold_of[group] = (offset + np.arange(len(group))) % folds
+        offset += len(group)
+
+    return [(np.flatnonzero(fold_of != k), np.flatnonzero(fold_of == k))
+            for k in range(0, folds)]
+
+
+def _init_worker(store_dir):
+    """
+    Memory-maps the shared features and target classes in a worker process.
+    :param store_dir: Directory holding the feature store.
+    """
+    for name in ('X', 'y'):
+        _WORKER_DATA[name] = np.load(os.path.join(store_dir, name + '.npy'),
+                                     mmap_mode='r')
+
+
+def _run_fold(classifier, train, test, fit_params, predict_params):
+    """
+    :return: Predicted target classes of the test images of a fold.
+    """
+    x, y = _WORKER_DATA['X'], _WORKER_DATA['y']
+    classifier.fit(x[train], np.asarray(y[train]), **fit_params)
+    return np.asarray(classifier.predict(x[test], **predict_params))
+
+
+class CrossValidator:
+    """CrossValidator"""
+
+    def __init__(self,
+                 classifier,
+                 extractor=None,
+                 folds=5,
+                 n_jobs=1,
+                 random_state=None,
+                 fit_params=None,
+                 predict_params=None):
+        """
+        :param classifier: An unfitted classifier with fit(x, y) and
+        predict(x). Every fold fits its own copy, which must be picklable
+        if n_jobs > 1.
+        :param extractor: A BaseExtractor instance (None to classify the
+        pixels). Features are extracted once for the whole dataset, so the
+        extractor must not learn from the test images.
+        :param folds: Number of folds.
+        :param n_jobs: Number of worker processes (-1 for all cores).
+        :param random_state: Seed of the fold shuffling.
+        :param fit_params: Keyword arguments of classifier.fit.
+        :param predict_params: Keyword arguments of classifier.predict.
+        """
+        self.classifier = classifier
+        self.extractor = extractor
+        self.folds = folds
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.fit_params = fit_params or {}
+        self.predict_params = predict_params or {}
+        self.results = None
+
+    def evaluate(self, x, y=None):
+        """
+        :param x: A list of 2d numpy arrays that represent pixel values(0/1),
+        a 3d numpy array or an OCRDataset.
+        :param y: A list of the corresponding target classes for the images
+        (defaults to the labels of an OCRDataset).
+        :return: A list of per fold results, dicts with the test indices,
+        y_pred, the ConfusionMatrix and the metrics map of the fold.
+        """
+        if y is None:
+            y = x.labels
+        y = np.asarray(y)
+        splits = stratified_folds(y, self.folds, self.random_state)
+
+        with profiling.stage('CrossValidator.evaluate',
+                             items=len(y),
+                             folds=self.folds):
+            with tempfile.TemporaryDirectory() as store_dir:
+                x_path = os.path.join(store_dir, 'X.npy')
+                batch = as_batch(x)
+                if self.extractor is None:
+                    np.save(x_path, batch)
+                else:
+                    self.extractor.fit(x)
+                    self.extractor.transform_to_file(batch, x_path,
+                                                     len(batch),
+                                                     batch.shape[1:])
+                np.save(os.path.join(store_dir, 'y.npy'), y)
+
+                predictions = self._run(store_dir, splits)
+
+        self.results = []
+        for (_, test), y_pred in zip(splits, predictions):
+            confusion = ConfusionMatrix().update(y[test], y_pred)
+            self.results.append({
+                'test': test,
+                'y_pred': y_pred,
+                'confusion': confusion,
+                'metrics': confusion.metrics_map()
+            })
+        return self.results
+
+    def _run(self, store_dir, splits):
+        """
+        :return: A list of predicted target classes per fold.
+        """
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+        if n_jobs <= 1:
+            _init_worker(store_dir)
+            try:
+                return [
+                    _run_fold(copy.deepcopy(self.classifier), train, test,
+                              self.fit_params, self.predict_params)
+                    for train, test in splits
+                ]
+            finally:
+                _WORKER_DATA.clear()
+
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(splits)),
+                                 initializer=_init_worker,
+                                 initargs=(store_dir, )) as pool:
+            futures = [
+                pool.submit(_run_fold, self.classifier, train, test,
+                            self.fit_params, self.predict_params)
+                for train, test in splits
+            ]
+            return [future.result() for future in futures]
+
+    def metrics_map(self):
+        """
+        :return: Metrics averaged over the folds, see
+        utils.extract_json_stats.
+        """
+        if self.results is None:
+            raise RuntimeError('Call evaluate first.')
+        return {
+            name: float(
+                np.mean([result['metrics'][name] for result in self.results]))
+            for name in self.results[0]['metrics']
+        }
+
+    def extract_json_stats(self, filename):
+        """
+        Writes the averaged metrics and the confusion matrix summed over
+        the folds in the utils.extract_json_stats format.
+        :param filename: Output json filename.
+        """
+        confusion = ConfusionMatrix()
+        for result in self.results:
+            confusion.merge(result['confusion'])
+        confusion.extract_json_stats(filename,
+                                     self.metrics_map(),
+                                     folds=self.folds)
@@ -1,36 +1,96 @@
 """This module contains a customized Pillow Image class."""
 import numpy as np
+from mlchr.utils.dataset import OCRDataset
 
 
 class OCRImage:
-    """OCRImage"""
+    """
+    OCRImage. The pixel matrix (uint8, 1 for foreground) is created from
+    the Pillow image on first access.
+    """
+
+    __slots__ = ('img_id', 'img_class', 'img_hex', 'width', 'height',
+                 'drop_pil', '_matrix', '_pil_image')
 
     def __init__(self,
                  pil_image,
                  img_id=None,
                  img_class=None,
                  matrix=None,
-                 img_hex=None):
+                 img_hex=None,
+                 drop_pil=False):
         """
-        :param pil_image: Pillow Image.
+        :param pil_image: Pillow Image (None if a matrix is given).
         https://pillow.readthedocs.io/en/stable/reference/Image.html
         :param img_id: Unique id for image object.
         :param img_class: Image class.
         :param matrix: 2d numpy array with image pixels (0/1).
+        :param drop_pil: Release the Pillow image once the matrix exists.
         """
+        if pil_image is None and matrix is None:
+            raise ValueError('Either pil_image or matrix is required.')
         self.img_id = img_id
         self.img_class = img_class
         self.img_hex = img_hex
-        self.matrix = matrix
-        self.pil_image = pil_image.convert('1')
-        self.width, self.height = self.pil_image.size
+        self.drop_pil = drop_pil
+        self._pil_image = None
+        self._matrix = None
+        if pil_image is not None:
+            self.pil_image = pil_image.convert('1')
+        if matrix is not None:
+            self.matrix = matrix
+
+    @property
+    def pil_image(self):
+        """
+        :return: The Pillow image, None if it was released.
+        """
+        return self._pil_image
+
+    @pil_image.setter
+    def pil_image(self, pil_image):
+        """
+        :param pil_image: A Pillow image replacing the current one, the
+        matrix is created again on next access.
+        """
+        self._pil_image = pil_image
+        if pil_image is not None:
+            self._matrix = None
+            self.width, self.height = pil_image.size
+
+    @property
+    def matrix(self):
+        """
+        :return: 2d uint8 numpy array with image pixels (0/1).
+        """
+        if self._matrix is None and self._pil_image is not None:
+            self.create_matrix()
+        return self._matrix
+
+    @matrix.setter
+    def matrix(self, matrix):
+        """
+        :param matrix: 2d numpy array with image pixels (0/1).
+        """
+        self._matrix = matrix
+        if matrix is not None:
+            self.height, self.width = matrix.shape
+            if self.drop_pil:
+                self._pil_image = None
 
     def create_matrix(self):
         """
         Create 2d array of binary image
         """
-        self.matrix = np.array(self.pil_image)
-        self.matrix = (1 - self.matrix).astype(int)
+        # mode '1' pixels are True for white (background)
+        self.matrix = np.logical_not(self._pil_image).view(np.uint8)
+
+    def release_pil(self):
+        """
+        Creates the matrix if needed and releases the Pillow image.
+        """
+        if self.matrix is not None:
+            self._pil_image = None
 
     def print(self):
         """
@@ -45,4 +105,35 @@ class OCRImage:
         """
         Show image
         """
-        self.pil_image.show()
+        if self._pil_image is not None:
+            self._pil_image.show()
+            return
+
+        # imported here so the module itself does not need Pillow
+        from PIL import Image
+
+        Image.fromarray(self.matrix == 0).show()
+
+
+def as_batch(x):
+    """
+    :param x: A list of 2d numpy arrays or OCRImage images, a 3d numpy
+    array (N x H x W) or an OCRDataset.
+    :return: A 3d numpy array (N x H x W) of pixel values.
+    """
+    if isinstance(x, OCRDataset):
+        return x.pixels
+    if isinstance(x, np.ndarray):
+        if x.ndim != 3:
+            raise ValueError('Expected an (N, H, W) array of images.')
+        return x
+
+    matrices = [
+        img.matrix if isinstance(img, OCRImage) else np.asarray(img)
+        for img in x
+    ]
+    if not matrices:
+        return np.zeros((0, 0, 0), dtype=np.uint8)
+    if len({matrix.shape for matrix in matrices}) > 1:
+        raise ValueError('All images must have the same shape.')
+    return np.stack(matrices)
@@ -0,0 +1,165 @@
+"""
+This module contains a streaming confusion matrix. It is updated from
+batches of predictions, merges across processes and produces the metrics
+and confusion matrix report without keeping per-image labels.
+"""
+import json
+import numpy as np
+
+
+class ConfusionMatrix:
+    """ConfusionMatrix"""
+
+    def __init__(self, labels=None):
+        """
+        :param labels: Known target classes (more are added as they are
+        seen).
+        """
+        self.labels = []
+        self.index = {}
+        self.matrix = np.zeros((0, 0), dtype=np.int64)
+        self._add_labels([] if labels is None else labels)
+
+    def _add_labels(self, labels):
+        """
+        :param labels: Target classes, new ones get the next rows/columns.
+        """
+        labels = [
+            label.item() if isinstance(label, np.generic) else label
+            for label in labels
+        ]
+        new = [label for label in labels if label not in self.index]
+        if not new:
+            return
+        for label in new:
+            self.index[label] = len(self.labels)
+            self.labels.append(label)
+        matrix = np.zeros((len(self.labels), len(self.labels)),
+                          dtype=np.int64)
+        k = len(self.matrix)
+        matrix[:k, :k] = self.matrix
+        self.matrix = matrix
+
+    def update(self, y_true, y_pred):
+        """
+        :param y_true: A batch of target values.
+        :param y_pred: The predicted target values of the batch.
+        :return: self
+        """
+        y_true = np.asarray(y_true).ravel()
+        y_pred = np.asarray(y_pred).ravel()
+        if len(y_true) != len(y_pred):
+            raise ValueError('y_true and y_pred must have the same length.')
+        if not len(y_true):
+            return self
+
+        # map the batch labels to matrix indices through its unique values
+        values, inverse = np.unique(np.concatenate((y_true, y_pred)),
+                                    return_inverse=True)
+        values = [value.item() for value in values]
+        self._add_labels(values)
+        codes = np.array([self.index[value] for value in values],
+                         dtype=np.int64)[inverse.ravel()]
+
+        np.add.at(self.matrix, (codes[:len(y_true)], codes[len(y_true):]),
+                  1)
+        return self
+
+    def merge(self, other):
+        """
+        :param other: A ConfusionMatrix, e.g. of another worker process.
+        :return: self
+        """
+        self._add_labels(other.labels)
+        rows = np.array([self.index[label] for label in other.labels],
+                        dtype=np.int64)
+        self.matrix[np.ix_(rows, rows)] += other.matrix
+        return self
+
+    def sorted(self):
+        """
+        :return: Sorted target classes and the matrix in their order.
+        """
+        order = sorted(range(len(self.labels)),
+                       key=lambda i: self.labels[i])
+        return ([self.labels[i] for i in order],
+                self.matrix[np.ix_(order, order)])
+
+    def count(self):
+        """
+        :return: Number of predictions.
+        """
+        return int(self.matrix.sum())
+
+    def accuracy(self):
+        """
+        :return: Fraction of correct predictions.
+        """
+        total = self.count()
+        return float(np.trace(self.matrix) / total) if total else 0.0
+
+    def balanced_accuracy(self):
+        """
+        :return: Average recall of the target classes with test images.
+        """
+        support = self.matrix.sum(axis=1)
+        seen = support > 0
+        if not seen.any():
+            return 0.0
+        return float(np.mean(np.diag(self.matrix)[seen] / support[seen]))
+
+    def metrics_map(self):
+        """
+        :return: Metrics map, see utils.extract_json_stats. Micro averaged
+        precision, recall and F-measure equal the accuracy of single-label
+        predictions.
+        """
+        accuracy = self.accuracy()
+        return {
+            'accuracy_score_j': accuracy,
+            'balanced_accuracy_score_j': self.balanced_accuracy(),
+            'precision_score_j': accuracy,
+            'recall_score_j': accuracy,
+            'f_measure_j': accuracy
+        }
+
+    def to_dict(self):
+        """
+        :return: Confusion matrix dictionary, see
+        utils.get_confusion_matrix_dict.
+        """
+        classes, cm = self.sorted()
+
+        # normalize (e.g. get percentage of accuracy and not support)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cm_normalized = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
+
+        conf_matrix_j = {}
+        for i, label in enumerate(classes):
+            conf_matrix_j[label] = {'count': int(cm[i].sum())}
+            for j in np.flatnonzero(cm_normalized[i] != 0):
+                conf_matrix_j[label][classes[j]] = [
+                    int(cm[i, j]), float(cm_normalized[i, j])
+                ]
+        return conf_matrix_j
+
+    def extract_json_stats(self, filename, metrics_map=None, folds=5):
+        """
+        :param filename: Output json filename.
+        :param metrics_map: Metrics map (computed from the matrix by
+        default).
+        :param folds: Number of folds of the evaluation.
+        """
+        metrics_map = metrics_map or self.metrics_map()
+        classification_report_json = {
+            'avg_accuracy_score': metrics_map['accuracy_score_j'],
+            'avg_balanced_accuracy_score':
+            metrics_map['balanced_accuracy_score_j'],
+            'avg_precision_score (micro)': metrics_map['precision_score_j'],
+            'avg_recall_score (micro)': metrics_map['recall_score_j'],
+            'avg_f_measure_score (micro)': metrics_map['f_measure_j'],
+            'confusion_matrix(fold {0}/{0})'.format(folds): self.to_dict()
+        }
+
+        with open(filename, 'w') as fp:
+            json.dump(classification_report_json, fp, indent=4)
@@ -0,0 +1,265 @@
+"""
+This module contains the pipeline instrumentation. The loader, the
+normalizer, the feature extractors and the classifiers run their work
+inside stages, and every finished stage is reported to the registered
+sinks as a record with its wall time, CPU time, items, bytes and
+throughput. Without registered sinks a stage does nothing.
+
+Usage:
+    with profiling.profile() as recorder:
+        features = extractor.transform(images)
+    recorder.to_json('profile.json')
+"""
+import contextlib
+import contextvars
+import json
+import threading
+import time
+import tracemalloc
+
+# callables that receive the record of every finished stage
+_SINKS = []
+
+# stages open in the current thread or asyncio task, innermost last
+_STACK = contextvars.ContextVar('mlchr_profiling_stack', default=())
+
+
+class _NullStage:
+    """Stage used while instrumentation is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def update(self, items=None, nbytes=None, **info):
+        """update"""
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Stage:
+    """Stage"""
+
+    def __init__(self, name, items=None, nbytes=None, **info):
+        """
+        :param name: Stage name, e.g. 'ZonesExtractor.transform'.
+        :param items: Number of items (images) processed.
+        :param nbytes: Number of bytes produced.
+        :param info: Extra fields of the record.
+        """
+        self.name = name
+        self.items = items
+        self.nbytes = nbytes
+        self.info = info
+        self.parent = None
+        self._wall = None
+        self._cpu = None
+        self._memory = None
+        self._peak = 0
+
+    def update(self, items=None, nbytes=None, **info):
+        """
+        Sets values known only once the work is done.
+        :param items: Number of items (images) processed.
+        :param nbytes: Number of bytes produced.
+        :param info: Extra fields of the record.
+        """
+        if items is not None:
+            self.items = items
+        if nbytes is not None:
+            self.nbytes = nbytes
+        self.info.update(info)
+
+    def __enter__(self):
+        stack = _STACK.get()
+        self.parent = stack[-1] if stack else None
+        _STACK.set(stack + (self, ))
+        if tracemalloc.is_tracing():
+            self._memory = _traced_memory(self.parent)
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        _STACK.set(tuple(item for item in _STACK.get() if item is not self))
+
+        record = {
+            'stage': self.name,
+            'parent': self.parent.name if self.parent else None,
+            'wall': wall,
+            'cpu': cpu,
+            'items': self.items,
+            'bytes': self.nbytes,
+            'throughput': self.items / wall if self.items and wall else None,
+            'error': exc_info[0].__name__ if exc_info[0] else None
+        }
+        if self._memory is not None and tracemalloc.is_tracing():
+            current, peak = _traced_memory(self.parent)
+            peak = max(peak, self._peak)
+            if self.parent is not None:
+                self.parent._peak = max(self.parent._peak, peak)
+            record['allocated'] = current - self._memory[0]
+            record['peak_allocated'] = peak - self._memory[0]
+        record.update(self.info)
+        emit(record)
+        return False
+
+
+def _traced_memory(parent):
+    """
+    Reads the traced memory and resets its peak, passing the peak so far on
+    to the enclosing stage.
+    :return: Current and peak traced memory in bytes.
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    if parent is not None:
+        parent._peak = max(parent._peak, peak)
+    # reset_peak is available from Python 3.9
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    return current, peak
+
+
+def stage(name, items=None, nbytes=None, **info):
+    """
+    :param name: Stage name, e.g. 'ZonesExtractor.transform'.
+    :param items: Number of items (images) processed.
+    :param nbytes: Number of bytes produced.
+    :param info: Extra fields of the record.
+    :return: A context manager that reports the stage to the sinks, or a
+    no-op if no sink is registered.
+    """
+    if not _SINKS:
+        return _NULL_STAGE
+    return Stage(name, items, nbytes, **info)
+
+
+def enabled():
+    """
+    :return: True if at least one sink is registered.
+    """
+    return bool(_SINKS)
+
+
+def add_sink(sink):
+    """
+    :param sink: A callable that receives the record (dict) of every
+    finished stage.
+    """
+    _SINKS.append(sink)
+
+
+def remove_sink(sink):
+    """
+    :param sink: A registered sink.
+    """
+    _SINKS.remove(sink)
+
+
+def emit(record):
+    """
+    :param record: A stage record passed on to every sink.
+    """
+    for sink in list(_SINKS):
+        sink(record)
+
+
+@contextlib.contextmanager
+def profile(sink=None, trace_memory=False):
+    """
+    Registers a sink for the duration of the block.
+    :param sink: A sink (a new Recorder by default).
+    :param trace_memory: Trace allocations with tracemalloc, adding the
+    allocated bytes of every stage to its record (slow).
+    :return: The sink.
+    """
+    sink = Recorder() if sink is None else sink
+    start_tracing = trace_memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    add_sink(sink)
+    try:
+        yield sink
+    finally:
+        remove_sink(sink)
+        if start_tracing:
+            tracemalloc.stop()
+
+
+class Recorder:
+    """Sink that keeps the records in memory."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def clear(self):
+        """
+        Removes every record.
+        """
+        with self._lock:
+            self.records = []
+
+    def summary(self):
+        """
+        :return: Totals per stage name: calls, wall and CPU time, items,
+        bytes and throughput.
+        """
+        stages = {}
+        for record in self.records:
+            total = stages.setdefault(record['stage'], {
+                'calls': 0,
+                'wall': 0.0,
+                'cpu': 0.0,
+                'items': 0,
+                'bytes': 0
+            })
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            total['items'] += record['items'] or 0
+            total['bytes'] += record['bytes'] or 0
+        for total in stages.values():
+            total['throughput'] = (total['items'] / total['wall']
+                                   if total['items'] and total['wall'] else
+                                   None)
+        return stages
+
+    def to_json(self, filename):
+        """
+        :param filename: Output json filename with the summary and records.
+        """
+        with open(filename, 'w') as fp:
+            json.dump({
+                'summary': self.summary(),
+                'records': self.records
+            },
+                      fp,
+                      indent=4)
+
+
+class JSONLinesSink:
+    """Sink that appends every record to a file as a line of JSON."""
+
+    def __init__(self, filename):
+        """
+        :param filename: Output filename.
+        """
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            with open(self.filename, 'a') as fp:
+                fp.write(json.dumps(record) + '\n')
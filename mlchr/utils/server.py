@@ -0,0 +1,398 @@
+"""
+This module contains an asyncio inference server. Concurrent single-glyph
+requests are coalesced into micro-batches (up to max_batch_size images,
+waiting at most max_wait seconds for more) that run through a Pipeline of
+Normalizer, extractor and classifier on a thread pool.
+
+Endpoints (HTTP/1.1 over TCP or a Unix socket):
+    POST /predict  body: an image file (e.g. PNG), or JSON
+                   {"pixels": [[0, 1, ...], ...]}; reply: {"class": ...}
+    GET  /stats    request, batch, latency (p50/p99) and throughput counters
+Images the pipeline cannot classify (see Pipeline.check) get a 400 reply.
+"""
+import asyncio
+import collections
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from mlchr.utils import profiling
+from mlchr.utils.image import OCRImage, as_batch
+
+
+class Pipeline:
+    """Pipeline"""
+
+    def __init__(self,
+                 classifier,
+                 extractor=None,
+                 normalizer=None,
+                 image_shape=None):
+        """
+        :param classifier: A fitted classifier with predict(x).
+        :param extractor: A BaseExtractor instance (None to classify the
+        pixels).
+        :param normalizer: A Normalizer instance (None if images already
+        have the classifier's size).
+        :param image_shape: (height, width) the images must have when there
+        is no normalizer (None to accept any size).
+        """
+        self.classifier = classifier
+        self.extractor = extractor
+        self.normalizer = normalizer
+        self.image_shape = image_shape
+
+    def check(self, image):
+        """
+        Raises a ValueError if the pipeline cannot classify the image.
+        :param image: An OCRImage or a 2d numpy array of pixel values (0/1).
+        """
+        if isinstance(image, OCRImage):
+            shape = (image.height, image.width)
+        else:
+            shape = np.shape(image)
+            if len(shape) != 2:
+                raise ValueError('Expected a 2d array of pixels.')
+        if (self.normalizer is None and self.image_shape is not None
+                and shape != tuple(self.image_shape)):
+            raise ValueError('Expected a {0}x{1} image, got {2}x{3}.'.format(
+                *self.image_shape, *shape))
+
+    def predict(self, images):
+        """
+        :param images: A list of OCRImage images or 2d numpy arrays of pixel
+        values (0/1).
+        :return: A list with the predicted target classes.
+        """
+        images = [
+            to_ocr_image(img) if self.normalizer is not None
+            and not isinstance(img, OCRImage) else img for img in images
+        ]
+        if self.normalizer is not None:
+            x = self.normalizer.pillow_resize_batch(images, n_workers=1)
+        else:
+            x = as_batch(images)
+
+        if self.extractor is not None:
+            x = self.extractor.transform(x)
+        return list(self.classifier.predict(x))
+
+
+def to_ocr_image(pixels):
+    """
+    :param pixels: 2d numpy array of pixel values (0/1).
+    :return: An OCRImage with black foreground pixels.
+    """
+    from PIL import Image
+
+    return OCRImage(
+        Image.fromarray(((1 - np.asarray(pixels)) * 255).astype(np.uint8)))
+
+
+class MicroBatcher:
+    """MicroBatcher"""
+
+    def __init__(self,
+                 pipeline,
+                 max_batch_size=64,
+                 max_wait=0.005,
+                 n_workers=1,
+                 window=10000):
+        """
+        :param pipeline: A Pipeline instance.
+        :param max_batch_size: Maximum number of images per batch.
+        :param max_wait: Maximum seconds the first image of a batch waits
+        for more images.
+        :param n_workers: Number of batches run at a time, on threads.
+        :param window: Number of recent request latencies kept for the
+        percentiles.
+        """
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.n_workers = n_workers
+        self.latencies = collections.deque(maxlen=window)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.n_errors = 0
+        self.started = None
+        self._queue = None
+        self._pool = None
+        self._task = None
+
+    async def start(self):
+        """
+        Starts the batching loop on the running event loop.
+        """
+        self._queue = asyncio.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=self.n_workers)
+        self._task = asyncio.ensure_future(self._run())
+        self.started = time.perf_counter()
+
+    async def stop(self):
+        """
+        Stops the batching loop and the worker threads.
+        """
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._pool.shutdown()
+
+    async def predict(self, image):
+        """
+        :param image: An OCRImage or a 2d numpy array of pixel values (0/1).
+        :return: The predicted target class.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        """
+        Collects requests into batches and hands them to the workers, with
+        at most n_workers batches in flight.
+        """
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.n_workers)
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await slots.acquire()
+            asyncio.ensure_future(self._run_batch(batch, slots))
+
+    async def _run_batch(self, batch, slots):
+        """
+        Runs a batch on a worker thread and resolves its requests. If the
+        batch fails, its images are retried one at a time so that only the
+        failing requests get the error.
+        """
+        loop = asyncio.get_running_loop()
+        images = [image for image, _, _ in batch]
+        try:
+            with profiling.stage('MicroBatcher.batch', items=len(batch)):
+                try:
+                    y = await loop.run_in_executor(self._pool,
+                                                   self.pipeline.predict,
+                                                   images)
+                    results = [(label, None) for label in y]
+                except Exception:  # pylint: disable=broad-except
+                    if len(batch) == 1:
+                        raise
+                    results = await loop.run_in_executor(
+                        self._pool, self._predict_each, images)
+        except Exception as error:  # pylint: disable=broad-except
+            results = [(None, error)] * len(batch)
+
+        now = time.perf_counter()
+        for (_, future, received), (label, error) in zip(batch, results):
+            if error is not None:
+                self.n_errors += 1
+                if not future.done():
+                    future.set_exception(error)
+                continue
+            self.latencies.append(now - received)
+            if not future.done():
+                future.set_result(label)
+        self.n_requests += len(batch)
+        self.n_batches += 1
+        slots.release()
+
+    def _predict_each(self, images):
+        """
+        :return: A (label, None) or (None, error) pair for every image.
+        """
+        results = []
+        for image in images:
+            try:
+                results.append((self.pipeline.predict([image])[0], None))
+            except Exception as error:  # pylint: disable=broad-except
+                results.append((None, error))
+        return results
+
+    def stats(self):
+        """
+        :return: Request and batch counters, latency percentiles (seconds)
+        of the recent requests and throughput (requests/s) since start.
+        """
+        latencies = np.asarray(self.latencies)
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return {
+            'requests': self.n_requests,
+            'errors': self.n_errors,
+            'batches': self.n_batches,
+            'mean_batch_size':
+            self.n_requests / self.n_batches if self.n_batches else 0.0,
+            'p50_latency':
+            float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'p99_latency':
+            float(np.percentile(latencies, 99)) if len(latencies) else None,
+            'throughput': self.n_requests / elapsed if elapsed else 0.0
+        }
+
+
+def decode(body, content_type):
+    """
+    :param body: Request body.
+    :param content_type: Content-Type header value.
+    :return: An OCRImage, or a 2d numpy array for a JSON body.
+    """
+    if content_type.startswith('application/json'):
+        return np.asarray(json.loads(body.decode())['pixels'], dtype=np.uint8)
+
+    from PIL import Image
+
+    with Image.open(io.BytesIO(body)) as pil_image:
+        return OCRImage(pil_image)
+
+
+def to_json(value):
+    """
+    :return: value converted from a numpy scalar to a JSON serializable one.
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class InferenceServer:
+    """InferenceServer"""
+
+    def __init__(self,
+                 batcher,
+                 host='127.0.0.1',
+                 port=8000,
+                 path=None,
+                 backlog=1024):
+        """
+        :param batcher: A MicroBatcher instance.
+        :param host: Host of the TCP server.
+        :param port: Port of the TCP server (0 for any free port).
+        :param path: Path of a Unix socket to listen on instead of TCP.
+        :param backlog: Maximum number of pending connections.
+        """
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self.path = path
+        self.backlog = backlog
+        self.server = None
+
+    async def start(self):
+        """
+        Starts the batcher and listens for connections.
+        """
+        await self.batcher.start()
+        if self.path is not None:
+            self.server = await asyncio.start_unix_server(
+                self._handle, path=self.path, backlog=self.backlog)
+        else:
+            self.server = await asyncio.start_server(self._handle,
+                                                     self.host,
+                                                     self.port,
+                                                     backlog=self.backlog)
+            self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Stops listening and stops the batcher.
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        """
+        Starts the server and serves until cancelled.
+        """
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle(self, reader, writer):
+        """
+        Serves the HTTP requests of a (keep-alive) connection.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target = request_line.decode('latin-1').split()[:2]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(
+                    int(headers.get('content-length', 0)))
+
+                status, reply = await self._route(method, target, headers,
+                                                  body)
+                payload = json.dumps(reply).encode()
+                writer.write(
+                    'HTTP/1.1 {0}\r\nContent-Type: application/json\r\n'
+                    'Content-Length: {1}\r\n\r\n'.format(
+                        status, len(payload)).encode('latin-1') + payload)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, target, headers, body):
+        """
+        :return: HTTP status line and reply object of a request.
+        """
+        if method == 'GET' and target == '/stats':
+            return '200 OK', self.batcher.stats()
+        if method != 'POST' or target != '/predict':
+            return '404 Not Found', {'error': 'not found'}
+
+        try:
+            image = decode(body, headers.get('content-type', ''))
+            self.batcher.pipeline.check(image)
+        except Exception as error:  # pylint: disable=broad-except
+            return '400 Bad Request', {'error': str(error)}
+        try:
+            label = await self.batcher.predict(image)
+        except Exception as error:  # pylint: disable=broad-except
+            return '500 Internal Server Error', {'error': str(error)}
+        return '200 OK', {'class': to_json(label)}
+
+
+def serve(pipeline,
+          host='127.0.0.1',
+          port=8000,
+          path=None,
+          max_batch_size=64,
+          max_wait=0.005,
+          n_workers=1):
+    """
+    Runs an InferenceServer until interrupted.
+    :param pipeline: A Pipeline instance.
+    :param host: Host of the TCP server.
+    :param port: Port of the TCP server.
+    :param path: Path of a Unix socket to listen on instead of TCP.
+    :param max_batch_size: Maximum number of images per batch.
+    :param max_wait: Maximum seconds a request waits for a batch to fill.
+    :param n_workers: Number of batches run at a time.
+    """
+    batcher = MicroBatcher(pipeline, max_batch_size, max_wait, n_workers)
+    asyncio.run(InferenceServer(batcher, host, port, path).serve_forever())
@@ -0,0 +1,82 @@
+"""
+This module contains a deterministic synthetic binary glyph generator, for
+benchmarks and experiments that need no dataset download.
+"""
+import os
+import numpy as np
+from mlchr.utils.dataset import OCRDataset
+
+
+def draw_line(canvas, start, stop, thickness=1):
+    """
+    :param canvas: 2d numpy array to draw on.
+    :param start: (row, column) of the first point.
+    :param stop: (row, column) of the last point.
+    :param thickness: Line thickness in pixels.
+    """
+    height, width = canvas.shape
+    steps = 2 * max(height, width)
+    rows = np.rint(np.linspace(start[0], stop[0], steps)).astype(int)
+    columns = np.rint(np.linspace(start[1], stop[1], steps)).astype(int)
+    for dr in range(0, thickness):
+        for dc in range(0, thickness):
+            canvas[np.clip(rows + dr, 0, height - 1),
+                   np.clip(columns + dc, 0, width - 1)] = 1
+
+
+def make_glyphs(n,
+                size=28,
+                n_classes=10,
+                strokes=3,
+                shift=2,
+                noise=0.02,
+                random_state=0):
+    """
+    Every class is a set of random strokes. Images of a class are the
+    strokes drawn with random thickness and shift, plus flipped pixels.
+    :param n: Number of images.
+    :param size: Image size (size x size).
+    :param n_classes: Number of classes.
+    :param strokes: Strokes per class.
+    :param shift: Maximum shift of an image in pixels.
+    :param noise: Probability of flipping a pixel.
+    :param random_state: Seed, equal seeds give equal datasets.
+    :return: An OCRDataset with uint8 pixels (0/1) and int labels.
+    """
+    rng = np.random.RandomState(random_state)
+    margin = shift + 1
+    classes = rng.randint(margin, size - margin - 1,
+                          size=(n_classes, strokes, 2, 2))
+
+    labels = np.arange(n) % n_classes
+    rng.shuffle(labels)
+    pixels = np.zeros((n, size, size), dtype=np.uint8)
+    for i, label in enumerate(labels):
+        offset = rng.randint(-shift, shift + 1, size=2)
+        thickness = rng.randint(1, 3)
+        for start, stop in classes[label]:
+            draw_line(pixels[i], start + offset, stop + offset, thickness)
+
+    pixels ^= (rng.random_sample(pixels.shape) < noise).astype(np.uint8)
+    return OCRDataset(pixels,
+                      labels=labels,
+                      hexes=['{0:04x}'.format(i) for i in range(n)])
+
+
+def write_folder(dataset, directory):
+    """
+    Writes images as PNG files into a folder with subfolders as image
+    classes, the layout read by utils.read_from_folder.
+    :param dataset: An OCRDataset.
+    :param directory: Output directory.
+    """
+    # imported here so the generator itself does not need Pillow
+    from PIL import Image
+
+    for i in range(0, len(dataset)):
+        class_dir = os.path.join(directory, str(dataset.labels[i]))
+        os.makedirs(class_dir, exist_ok=True)
+        # foreground pixels are black
+        image = Image.fromarray(
+            ((1 - dataset[i]) * 255).astype(np.uint8)).convert('1')
+        image.save(os.path.join(class_dir, dataset.hexes[i] + '.png'))
@@ -1,14 +1,10 @@
 """This module contains various utilities for the mlchr package."""
 import os
 import sys
-import glob
-import json
-import numpy as np
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from PIL import Image
-from mlchr.utils import image
-
-from sklearn.metrics import confusion_matrix
-from sklearn.utils.multiclass import unique_labels
+from mlchr.utils import image, metrics, profiling
 
 
 def get_confusion_matrix_dict(y_test, y_pred):
@@ -17,24 +13,7 @@ def get_confusion_matrix_dict(y_test, y_pred):
     :param y_pred: Predicted target values.
     :return: Confusion matrix dictionary.
     """
-
-    # create confusion matrix dictionary
-    conf_matrix_j = {}
-    classes = unique_labels(y_test, y_pred)
-    cm = confusion_matrix(y_test, y_pred, labels=classes)
-
-    # normalize (e.g. get percentage of accuracy and not support)
-    cm_normalized = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
-
-    for i in range(len(classes)):
-        conf_matrix_j[classes[i]] = {}
-        conf_matrix_j[classes[i]]['count'] = int(sum(cm[i]))
-        for j in range(len(classes)):
-            if cm_normalized[i][j] != 0:
-                conf_matrix_j[classes[i]][classes[j]] = [
-                    int(cm[i][j]), cm_normalized[i][j]
-                ]
-    return conf_matrix_j
+    return metrics.ConfusionMatrix().update(y_test, y_pred).to_dict()
 
 
 def extract_json_stats(y_test, y_pred, filename, metrics_map, folds=5):
@@ -45,25 +24,86 @@ def extract_json_stats(y_test, y_pred, filename, metrics_map, folds=5):
     :param metrics_map: Metrics map.
     :return: None
     """
+    metrics.ConfusionMatrix().update(y_test, y_pred).extract_json_stats(
+        filename, metrics_map, folds)
+
 
-    accuracy_score_j = metrics_map['accuracy_score_j']
-    balanced_accuracy_score_j = metrics_map['balanced_accuracy_score_j']
-    precision_score_j = metrics_map['precision_score_j']
-    recall_score_j = metrics_map['recall_score_j']
-    f_measure_j = metrics_map['f_measure_j']
-    conf_matrix_j = get_confusion_matrix_dict(y_test, y_pred)
+def list_folder(basedir, n_values=None):
+    """Lists images of a folder with subfolders as image classes, sorted by
+    class and file name.
+    :param basedir: Base directory.
+    :param n_values: Number of images to list per class (all if None).
+    :return: A list of (image file, image class) tuples.
+    """
+    image_files = []
+    for class_dir in sorted(os.listdir(basedir)):
+        class_path = os.path.join(basedir, class_dir)
+        if not os.path.isdir(class_path):
+            continue
+        files = sorted(f for f in os.listdir(class_path)
+                       if not f.startswith('.'))
+        if n_values is not None:
+            files = files[0:n_values]
+        image_files.extend(
+            (os.path.join(class_path, f), class_dir) for f in files)
+    return image_files
+
+
+def load_images(image_files, first_id=0):
+    """
+    :param image_files: A list of (image file, image class) tuples.
+    :param first_id: Id of the first image.
+    :return: A list of OCRImage class instances.
+    """
+    images = []
+    with profiling.stage('load_images') as stage:
+        for img_id, (image_file, class_dir) in enumerate(image_files,
+                                                         first_id):
+            with Image.open(image_file) as pil_image:
+                images.append(
+                    image.OCRImage(pil_image=pil_image,
+                                   img_id=img_id,
+                                   img_class=class_dir,
+                                   img_hex=image_file[:-4][-4:]))
+        # decoded mode '1' images hold one byte per pixel
+        stage.update(items=len(images),
+                     nbytes=sum(img.width * img.height for img in images)
+                     if profiling.enabled() else None)
+    return images
 
-    classification_report_json = {
-        'avg_accuracy_score': accuracy_score_j,
-        'avg_balanced_accuracy_score': balanced_accuracy_score_j,
-        'avg_precision_score (micro)': precision_score_j,
-        'avg_recall_score (micro)': recall_score_j,
-        'avg_f_measure_score (micro)': f_measure_j,
-        'confusion_matrix(fold {0}/{0})'.format(folds): conf_matrix_j
-    }
 
-    with open(filename, 'w') as fp:
-        json.dump(classification_report_json, fp, indent=4)
+def iter_folder(basedir,
+                batch_size=1024,
+                n_values=None,
+                n_workers=None,
+                use_processes=False,
+                prefetch=None):
+    """Decodes images from folder with subfolders as image classes on a
+    worker pool and yields them in batches, in deterministic order.
+    :param basedir: Base directory.
+    :param batch_size: Number of images per batch.
+    :param n_values: Number of images to load per class (all if None).
+    :param n_workers: Number of worker threads or processes.
+    :param use_processes: Decode on processes instead of threads.
+    :param prefetch: Number of batches decoded ahead of the consumer
+    (defaults to the number of workers).
+    :return: A generator of lists of OCRImage class instances.
+    """
+    image_files = list_folder(basedir, n_values)
+    n_workers = n_workers or os.cpu_count()
+    prefetch = prefetch or n_workers
+    executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+
+    with executor(max_workers=n_workers) as pool:
+        pending = collections.deque()
+        for start in range(0, len(image_files), batch_size):
+            pending.append(
+                pool.submit(load_images,
+                            image_files[start:start + batch_size], start))
+            if len(pending) > prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
 def read_from_folder(args, n_values=50):
@@ -73,24 +113,13 @@ def read_from_folder(args, n_values=50):
     :return: A list of OCRImage class instances.
     """
     images = []
-    img_id = 0
     basedir = str(args['input_train'])
-    class_dirs = os.listdir(basedir)
-    # load images from base directory
-    for class_dir in class_dirs:
-        image_files = glob.glob(os.path.join(basedir, class_dir, "*"))
-
-        # test case
-        if args['test']:
-            image_files = image_files[0:n_values]
-
-        for image_file in image_files:
-            img = image.OCRImage(pil_image=Image.open(image_file),
-                                 img_id=img_id,
-                                 img_class=class_dir,
-                                 img_hex=image_file[:-4][-4:])
-            images.append(img)
-            img_id += 1
+    # test case
+    n_values = n_values if args['test'] else None
+    with profiling.stage('read_from_folder') as stage:
+        for batch in iter_folder(basedir, n_values=n_values):
+            images.extend(batch)
+        stage.update(items=len(images))
 
     return images
 